@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+
+# Modules used by headless workers, that must not import any of the FORBIDDEN_MODULES
+HEADLESS_MODULES = ['ch2_knn.kNN', 'ch2_knn.knn_parallel', 'ch2_knn.knn_prototypes', 'ch2_knn.knn_store',
+                    'ch2_knn.knn_validation', 'ch3_trees.trees', 'ch3_trees.trees_compiled',
+                    'ch3_trees.trees_forest', 'ch3_trees.trees_parallel', 'ch3_trees.trees_pruning',
+                    'ch3_trees.trees_streaming']
+FORBIDDEN_MODULES = ['matplotlib', 'scipy', 'pandas']
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter, so nothing is imported beforehand
+IMPORT_SCRIPT = """
+import json, sys, time
+start_time = time.time()
+import {module}
+import_time = time.time() - start_time
+print(json.dumps({{'time': import_time, 'modules': sorted(set(name.split('.')[0] for name in sys.modules))}}))
+"""
+
+
+def measure_import(module):
+    """Imports a module in a new interpreter
+
+    :param module: dotted name of the module
+    :returns: (seconds spent importing it, list of the top level packages loaded by the interpreter)
+    """
+    environment = dict(os.environ)
+    python_path = [ROOT_DIRECTORY] + [item for item in [environment.get('PYTHONPATH')] if item]
+    environment['PYTHONPATH'] = os.pathsep.join(python_path)
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT.format(module=module)], env=environment,
+                                     cwd=ROOT_DIRECTORY)
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    return result['time'], result['modules']
+
+
+def find_forbidden_imports(modules=HEADLESS_MODULES):
+    """Imports every module once, without printing nor timing anything, and finds the forbidden modules it loads
+
+        >>> import benchmarks.import_time as bench
+        >>> bench.find_forbidden_imports()
+        {}
+
+    :param modules: dotted names of the modules
+    :returns: dict with the forbidden modules loaded by every failing module
+    """
+    failures = {}
+    for module in modules:
+        loaded_modules = measure_import(module)[1]
+        forbidden = [name for name in FORBIDDEN_MODULES if name in loaded_modules]
+        if forbidden:
+            failures[module] = forbidden
+    return failures
+
+
+def benchmark_imports(modules=HEADLESS_MODULES, repeat=3):
+    """Measures the import time of the headless modules and checks that none of them loads the forbidden ones,
+    e.g. matplotlib, that is slow to import and fails in machines without display. See find_forbidden_imports for
+    the check alone.
+
+        >>> import benchmarks.import_time as bench
+        >>> timings, failures = bench.benchmark_imports()  # doctest: +SKIP
+
+    :param modules: dotted names of the modules
+    :param repeat: number of imports per module, the best one is reported
+    :returns: (dict with the best import time in seconds per module, dict with the forbidden modules loaded by
+     every failing module)
+    """
+    timings = {}
+    failures = {}
+    for module in modules:
+        times = []
+        for _ in range(repeat):
+            import_time, loaded_modules = measure_import(module)
+            times.append(import_time)
+        timings[module] = min(times)
+        forbidden = [name for name in FORBIDDEN_MODULES if name in loaded_modules]
+        if forbidden:
+            failures[module] = forbidden
+        print('{:<28} {:8.4f} s {}'.format(module, timings[module],
+                                           'imports ' + ', '.join(forbidden) if forbidden else 'ok'))
+    return timings, failures
+
+
+if __name__ == '__main__':
+    sys.exit(1 if benchmark_imports()[1] else 0)
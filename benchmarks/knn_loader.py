@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+from ch2_knn import kNN, knn_loader
+
+
+DATING_CLASSES = ('didntLike', 'smallDoses', 'largeDoses')
+
+
+def make_dating_like_file(filename, rows, num_features=3, classes=DATING_CLASSES, seed=0):
+    """Writes a synthetic data file with the format of the dating dataset
+        filename format: field1, field2, ..., fieldN, class
+
+    :param filename: output file
+    :param rows: number of examples
+    :param num_features: number of features per example
+    :param classes: classes to choose from
+    :param seed: seed of the random generator
+    """
+    random_state = np.random.RandomState(seed)
+    matrix = random_state.rand(rows, num_features) * 1000
+    labels = np.array(classes)[random_state.randint(0, len(classes), rows)]
+    with open(filename, 'w') as f:
+        for row, label in zip(matrix, labels):
+            f.write('\t'.join(['{:.6f}'.format(value) for value in row] + [label]) + '\n')
+
+
+def benchmark_loaders(filename, repeat=3):
+    """Compares the throughput of kNN.file_to_matrix and knn_loader.file_to_encoded_matrix on the same file.
+    file_to_matrix only reads 3 features, so the file should have 3 features per row.
+
+        >>> import benchmarks.knn_loader as bench
+        >>> timings = bench.benchmark_loaders('data/ch2/dating-test-set.txt')  # doctest: +ELLIPSIS
+        file_to_matrix ...
+        file_to_encoded_matrix ...
+        Speedup: ...x
+
+    :param filename: path to the data file
+    :param repeat: number of runs per loader, the best one is reported
+    :returns: dict with the best time in seconds per loader
+    """
+    size_mb = os.path.getsize(filename) / (1024.0 * 1024.0)
+    rows = len(knn_loader.file_to_encoded_matrix(filename)[1])
+    loaders = [('file_to_matrix', lambda: kNN.file_to_matrix(filename)),
+               ('file_to_encoded_matrix', lambda: knn_loader.file_to_encoded_matrix(filename))]
+
+    timings = {}
+    for name, loader in loaders:
+        timings[name] = min(timeit.repeat(loader, number=1, repeat=repeat))
+        print('{:<24} {:8.3f} s {:12.0f} rows/s {:8.2f} MB/s'.format(name, timings[name], rows/timings[name],
+                                                                     size_mb/timings[name]))
+    print('Speedup: {:.1f}x'.format(timings['file_to_matrix']/timings['file_to_encoded_matrix']))
+    return timings
+
+
+if __name__ == '__main__':
+    # python -m benchmarks.knn_loader [filename], a synthetic file of 1M rows is used by default
+    if len(sys.argv) > 1:
+        benchmark_loaders(sys.argv[1])
+    else:
+        synthetic_file = os.path.join(tempfile.mkdtemp(), 'dating-synthetic.txt')
+        make_dating_like_file(synthetic_file, 1000000)
+        benchmark_loaders(synthetic_file)
+        os.remove(synthetic_file)
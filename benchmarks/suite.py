@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+from benchmarks.knn_loader import make_dating_like_file
+from benchmarks.trees_predict import make_categorical_dataset
+from ch2_knn import kNN
+from ch3_trees import trees
+
+
+# Size of the synthetic datasets of every scale:
+#   * rows, dimensions, classes: numeric kNN datasets, and rows of the dating-like file
+#   * queries: number of vectors classified one by one with kNN.classify
+#   * digits: number of digit files read with img_to_vector
+#   * tree_rows, tree_features, cardinality, tree_classes: categorical datasets of the trees
+SCALES = {
+    'small': {'rows': 1000, 'dimensions': 3, 'classes': 3, 'queries': 100, 'digits': 50,
+              'tree_rows': 500, 'tree_features': 4, 'cardinality': 3, 'tree_classes': 2},
+    'medium': {'rows': 10000, 'dimensions': 32, 'classes': 5, 'queries': 100, 'digits': 200,
+               'tree_rows': 5000, 'tree_features': 8, 'cardinality': 4, 'tree_classes': 3},
+    'large': {'rows': 50000, 'dimensions': 256, 'classes': 10, 'queries': 20, 'digits': 1000,
+              'tree_rows': 50000, 'tree_features': 12, 'cardinality': 8, 'tree_classes': 5},
+}
+# Relative slowdown above which a benchmark is reported as a regression
+REGRESSION_THRESHOLD = 0.1
+
+
+def make_numeric_dataset(rows, dimensions, classes, seed=0):
+    """Synthetic numeric dataset for kNN, with a gaussian cluster per class
+
+    :param rows: number of elements
+    :param dimensions: number of features per element
+    :param classes: number of different classes
+    :param seed: seed of the random generator
+    :returns: (matrix with an element per row, vector with the class of every element)
+    """
+    random_state = np.random.RandomState(seed)
+    centers = random_state.rand(classes, dimensions) * 100
+    codes = random_state.randint(0, classes, rows)
+    matrix = centers[codes] + random_state.randn(rows, dimensions) * 10
+    return matrix, np.array(['class{}'.format(code) for code in codes])
+
+
+def make_digit_files(directory, count, number_of_pixels=32, seed=0):
+    """Writes synthetic digit files with the format of the handwriting dataset: number_of_pixels lines of
+    number_of_pixels 0/1 characters, named {class}_{index}.txt
+
+    :param directory: output directory, it must exist
+    :param count: number of files
+    :param number_of_pixels: number of pixels per side of the square
+    :param seed: seed of the random generator
+    :returns: list with the path of every file
+    """
+    random_state = np.random.RandomState(seed)
+    filenames = []
+    for i in range(count):
+        filename = os.path.join(directory, '{}_{}.txt'.format(i % 10, i))
+        pixels = random_state.randint(0, 2, (number_of_pixels, number_of_pixels))
+        with open(filename, 'w') as f:
+            f.write(''.join(''.join(str(pixel) for pixel in row) + '\n' for row in pixels))
+        filenames.append(filename)
+    return filenames
+
+
+def get_benchmarks(scale, directory):
+    """Builds the synthetic datasets of a scale and the functions to time on them
+
+    :param scale: dict with the sizes of the datasets, see SCALES
+    :param directory: directory for the synthetic files
+    :returns: list of (name, function to time, number of items it processes)
+    """
+    matrix, classes = make_numeric_dataset(scale['rows'], scale['dimensions'], scale['classes'])
+    norm_matrix = kNN.normalizer(matrix)[0]
+    queries = norm_matrix[:scale['queries']]
+
+    dating_file = os.path.join(directory, 'dating.txt')
+    make_dating_like_file(dating_file, scale['rows'])
+    digit_files = make_digit_files(directory, scale['digits'])
+
+    dataset, labels = make_categorical_dataset(scale['tree_rows'], scale['tree_features'], scale['cardinality'],
+                                               scale['tree_classes'])
+    tree = trees.create_tree(dataset, labels)
+    samples = [item[:-1] for item in dataset]
+
+    return [
+        ('knn.classify', lambda: [kNN.classify(query, norm_matrix, classes, kNN.K) for query in queries],
+         len(queries)),
+        ('knn.classify_batch', lambda: kNN.classify_batch(queries, norm_matrix, classes, kNN.K), len(queries)),
+        ('knn.normalizer', lambda: kNN.normalizer(matrix), scale['rows']),
+        ('knn.file_to_matrix', lambda: kNN.file_to_matrix(dating_file), scale['rows']),
+        ('knn.img_to_vector', lambda: [kNN.img_to_vector(filename) for filename in digit_files], len(digit_files)),
+        ('trees.create_tree', lambda: trees.create_tree(dataset, labels), scale['tree_rows']),
+        ('trees.create_tree_encoded', lambda: trees.create_tree_encoded(dataset, labels), scale['tree_rows']),
+        ('trees.choose_best_splitting_feature', lambda: trees.choose_best_splitting_feature(dataset),
+         scale['tree_rows']),
+        ('trees.classify', lambda: [trees.classify(tree, labels, sample) for sample in samples], len(samples)),
+    ]
+
+
+def run_suite(scales=('small',), repeat=3, only=None):
+    """Runs every benchmark at every scale
+
+        >>> import benchmarks.suite as suite
+        >>> results = suite.run_suite(['small'])  # doctest: +ELLIPSIS
+        knn.classify[small] ...
+        trees.classify[small] ...
+
+    :param scales: names of the scales, see SCALES
+    :param repeat: number of runs per benchmark, the best one is reported
+    :param only: optional list with the names of the benchmarks to run, all of them by default
+    :returns: dict with the environment and, per '{benchmark}[{scale}]', the best time in seconds, the number of
+     items processed and the items per second
+    """
+    results = {'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                               'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'benchmarks': {}}
+    for scale_name in scales:
+        directory = tempfile.mkdtemp()
+        try:
+            for name, function, items in get_benchmarks(SCALES[scale_name], directory):
+                if only and name not in only:
+                    continue
+                seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+                key = '{}[{}]'.format(name, scale_name)
+                results['benchmarks'][key] = {'seconds': seconds, 'items': items, 'items_per_second': items/seconds}
+                print('{:<48} {:10.4f} s {:14.1f} items/s'.format(key, seconds, items/seconds))
+        finally:
+            shutil.rmtree(directory)
+    return results
+
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Compares two runs of the suite, benchmark by benchmark
+
+    :param baseline: results of run_suite of the reference run
+    :param current: results of run_suite of the run to check
+    :param threshold: relative slowdown above which a benchmark is a regression, 0.1 is 10% slower
+    :returns: list with the names of the regressed benchmarks
+    """
+    regressions = []
+    for key in sorted(set(baseline['benchmarks']) & set(current['benchmarks'])):
+        ratio = current['benchmarks'][key]['seconds'] / baseline['benchmarks'][key]['seconds']
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(key)
+        print('{:<48} {:10.4f} s {:10.4f} s {:7.2f}x{}'.format(key, baseline['benchmarks'][key]['seconds'],
+                                                               current['benchmarks'][key]['seconds'], ratio,
+                                                               ' REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main(arguments=None):
+    """Command line of the suite:
+
+        python -m benchmarks.suite run [--scales small medium large] [--output results.json]
+        python -m benchmarks.suite compare baseline.json current.json [--threshold 0.1]
+
+    :returns: exit status, 1 when compare finds regressions
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--scales', nargs='+', default=['small'], choices=sorted(SCALES))
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--only', nargs='+', help='names of the benchmarks to run')
+    run_parser.add_argument('--output', help='JSON file for the results')
+    compare_parser = commands.add_parser('compare', help='compare two JSON results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    options = parser.parse_args(arguments)
+
+    if options.command == 'run':
+        results = run_suite(options.scales, options.repeat, options.only)
+        if options.output:
+            with open(options.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+    if options.command == 'compare':
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        with open(options.current) as f:
+            current = json.load(f)
+        return 1 if compare_results(baseline, current, options.threshold) else 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
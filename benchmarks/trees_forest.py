@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import time
+import timeit
+
+from ch3_trees import trees
+from ch3_trees.trees_compiled import compile_tree
+from ch3_trees.trees_forest import RandomForest
+
+
+def benchmark_forest(filename=trees.LENSES_DATASET, num_trees=50, processes=None, predict_repeat=1000, repeat=3):
+    """Compares a single ID3 tree with a random forest on the lenses data: leave-one-out accuracy, training time
+    and prediction throughput
+
+        >>> import benchmarks.trees_forest as bench
+        >>> results = bench.benchmark_forest()  # doctest: +ELLIPSIS
+        tree     accuracy ...
+        forest   accuracy ...
+
+    :param filename: path to the lenses data file
+    :param num_trees: number of trees of the forest
+    :param processes: number of worker processes used to build the forest, by default the number of cores
+    :param predict_repeat: number of copies of the dataset classified to measure the throughput
+    :param repeat: number of runs per measure, the best one is reported
+    :returns: dict with the accuracy, the training time in seconds and the samples classified per second of both
+     models
+    """
+    dataset, labels = trees.get_lenses_dataset(filename)
+
+    def fit_tree(training_dataset):
+        return compile_tree(trees.create_tree_encoded(training_dataset, labels), labels)
+
+    def fit_forest(training_dataset):
+        return RandomForest(num_trees, random_state=0, processes=processes).fit(training_dataset, labels)
+
+    results = {}
+    samples = [item[:-1] for item in dataset] * predict_repeat
+    for name, fit in [('tree', fit_tree), ('forest', fit_forest)]:
+        # Leave one out, samples the model has no branch for count as errors
+        hits = 0
+        for i, item in enumerate(dataset):
+            model = fit(dataset[:i] + dataset[i + 1:])
+            hits += model.predict([item[:-1]])[0] == item[-1]
+
+        start_time = time.time()
+        model = fit(dataset)
+        train_time = time.time() - start_time
+        predict_time = min(timeit.repeat(lambda: model.predict(samples), number=1, repeat=repeat))
+
+        results[name] = {'accuracy': hits/float(len(dataset)), 'train_time': train_time,
+                         'samples_per_second': len(samples)/predict_time}
+        print('{:<8} accuracy {:6.3f} train {:8.4f} s {:12.0f} samples/s'.format(
+            name, results[name]['accuracy'], train_time, results[name]['samples_per_second']))
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_forest()
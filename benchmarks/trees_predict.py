@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import timeit
+
+import numpy as np
+
+from ch3_trees import trees
+from ch3_trees.trees_compiled import compile_tree
+
+
+def make_categorical_dataset(rows, num_features, num_values, num_classes, noise=0.1, seed=0):
+    """Synthetic categorical dataset, whose class depends on the first features plus some noise
+
+    :param rows: number of elements
+    :param num_features: number of features per element
+    :param num_values: number of different values of every feature
+    :param num_classes: number of different classes
+    :param noise: fraction of elements with a random class
+    :param seed: seed of the random generator
+    :returns: (dataset, labels) in the format of trees.get_simple_dataset
+    """
+    random_state = np.random.RandomState(seed)
+    features = random_state.randint(0, num_values, (rows, num_features))
+    classes = features[:, :3].sum(axis=1) % num_classes
+    noisy = random_state.rand(rows) < noise
+    classes[noisy] = random_state.randint(0, num_classes, noisy.sum())
+
+    dataset = [list(row) + ['class{}'.format(clazz)] for row, clazz in zip(features.tolist(), classes)]
+    labels = ['feature{}'.format(i) for i in range(num_features)]
+    return dataset, labels
+
+
+def benchmark_predict(rows=20000, num_features=8, num_values=3, num_classes=3, repeat=3):
+    """Compares recursive trees.classify, one sample per call, with the vectorized prediction of a compiled tree
+
+        >>> import benchmarks.trees_predict as bench
+        >>> timings = bench.benchmark_predict()  # doctest: +ELLIPSIS
+        6151 nodes, 20000 samples
+        classify ...
+        compiled predict ...
+        compiled predict_codes ...
+
+    :param rows: number of elements, used both to train and to predict
+    :param num_features: number of features per element
+    :param num_values: number of different values of every feature
+    :param num_classes: number of different classes
+    :param repeat: number of runs per method, the best one is reported
+    :returns: dict with the best time in seconds per method
+    """
+    dataset, labels = make_categorical_dataset(rows, num_features, num_values, num_classes)
+    tree = trees.create_tree_encoded(dataset, labels)
+    compiled = compile_tree(tree, labels)
+    samples = [item[:-1] for item in dataset]
+    sample_codes = compiled.encode_samples(samples)
+
+    assert compiled.predict(samples) == [trees.classify(tree, labels, sample) for sample in samples]
+
+    methods = [('classify', lambda: [trees.classify(tree, labels, sample) for sample in samples]),
+               ('compiled predict', lambda: compiled.predict(samples)),
+               ('compiled predict_codes', lambda: compiled.predict_codes(sample_codes))]
+
+    print('{} nodes, {} samples'.format(compiled.num_nodes, len(samples)))
+    timings = {}
+    for name, method in methods:
+        timings[name] = min(timeit.repeat(method, number=1, repeat=repeat))
+        print('{:<24} {:8.4f} s {:12.0f} samples/s {:6.1f}x'.format(name, timings[name], len(samples)/timings[name],
+                                                                    timings['classify']/timings[name]))
+    return timings
+
+
+if __name__ == '__main__':
+    benchmark_predict()
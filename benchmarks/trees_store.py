@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import timeit
+
+from benchmarks.trees_predict import make_categorical_dataset
+from ch3_trees import trees, trees_compiled
+
+
+def benchmark_load(rows=50000, num_features=10, num_values=4, num_classes=3, repeat=5):
+    """Compares the load time of a big tree stored with pickle, trees.store_tree, and with the binary format of
+    trees_compiled, loaded as nested dictionaries and as a memory-mapped compiled tree.
+
+        >>> import benchmarks.trees_store as bench
+        >>> timings = bench.benchmark_load()  # doctest: +ELLIPSIS
+        19481 nodes, pickle ... bytes, binary ... bytes
+        grab_tree (pickle) ...
+        grab_tree_binary ...
+        load_compiled_tree ...
+        load_compiled_tree mmap ...
+
+    :param rows: number of elements of the synthetic dataset the tree is trained on
+    :param num_features: number of features per element
+    :param num_values: number of different values of every feature
+    :param num_classes: number of different classes
+    :param repeat: number of loads per method, the best one is reported
+    :returns: dict with the best time in seconds per method
+    """
+    dataset, labels = make_categorical_dataset(rows, num_features, num_values, num_classes)
+    tree = trees.create_tree_encoded(dataset, labels)
+
+    directory = tempfile.mkdtemp()
+    try:
+        pickle_file = os.path.join(directory, 'tree.pkl')
+        binary_file = os.path.join(directory, 'tree.id3')
+        trees.store_tree(tree, pickle_file)
+        trees_compiled.store_tree_binary(tree, binary_file, labels)
+        assert trees_compiled.grab_tree_binary(binary_file) == tree
+
+        methods = [('grab_tree (pickle)', lambda: trees.grab_tree(pickle_file)),
+                   ('grab_tree_binary', lambda: trees_compiled.grab_tree_binary(binary_file)),
+                   ('load_compiled_tree', lambda: trees_compiled.load_compiled_tree(binary_file, mmap=False)),
+                   ('load_compiled_tree mmap', lambda: trees_compiled.load_compiled_tree(binary_file))]
+
+        print('{} nodes, pickle {} bytes, binary {} bytes'.format(
+            trees_compiled.compile_tree(tree, labels).num_nodes, os.path.getsize(pickle_file),
+            os.path.getsize(binary_file)))
+        timings = {}
+        for name, method in methods:
+            timings[name] = min(timeit.repeat(method, number=1, repeat=repeat))
+            print('{:<24} {:10.6f} s'.format(name, timings[name]))
+        return timings
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    benchmark_load()
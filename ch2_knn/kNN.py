@@ -15,11 +15,13 @@ u"""Copyright 2015 Mariví Peláez
    limitations under the License.
 """
 
+import hashlib
+import os
 import numpy as np
-import operator
-import matplotlib.pyplot as plt
 from os import listdir, path
 
+from instrumentation.phases import argument_rows, instrumented, result_rows
+
 
 def create_dataset():
     """Creates the already-labeled dataset
@@ -30,44 +32,170 @@ def create_dataset():
     return group, labels
 
 
+@instrumented('knn.classify')
 def classify(test_vector, training_dataset, training_classes, k):
     """Classification for kNN algorithm, using Euclidean distance
 
         d = sqrt((x1 - x2)^2 + (y1 - y2)^2)
 
+    The square root does not change the order of the distances, so neighbors are selected with the squared
+    distance. Only the k closest elements are selected, with a partial sort, and ties in the vote are broken in
+    favour of the tied class holding the closest neighbor.
+
+        >>> import ch2_knn.kNN as knn
+        >>> group, labels = knn.create_dataset()
+        >>> knn.classify([0, 0], group, labels, 3)
+        'B'
+
     :param test_vector: vector of elements to be classified
     :param training_dataset: matrix of training elements
     :param training_classes: sorted vector of classes of the training dataset
     :param k: number of neighbors to use in the comparison algorithm
     :return: class of the given test_vector
     """
-    # shape[0] = number of rows
-    # shape[1] = number of columns
+    # Squared Euclidean distance between the test vector and every row of the training dataset
+    test_matrix = np.asarray(test_vector, dtype=np.float64).reshape(1, -1)
+    sq_distances = squared_distances(test_matrix, np.asarray(training_dataset, dtype=np.float64))
+
+    # Getting k lowest distances, from the closest to the farthest
+    nearest = k_nearest(sq_distances, k)[0]
+
+    # Integer encoding of the classes of the neighbors, to count votes with bincount
+    neighbor_classes = [training_classes[i] for i in nearest]
+    classes, neighbor_codes = np.unique(neighbor_classes, return_inverse=True)
+    neighbor_codes = neighbor_codes.reshape(1, -1)
+    winner = vote(neighbor_codes, len(classes))[0]
+
+    # Return the class as it is in training_classes, not its numpy copy
+    return neighbor_classes[list(neighbor_codes[0]).index(winner)]
+
+
+@instrumented('knn.distances', argument_rows(0))
+def squared_distances(test_matrix, training_dataset, training_sq_norms=None):
+    """Squared Euclidean distances between every query row and every training row, using the expansion
+
+        ||a - b||^2 = ||a||^2 - 2ab + ||b||^2
+
+    so the bulk of the work is a single matrix product instead of one tile/subtract pass per query.
+
+    :param test_matrix: matrix of query vectors, one per row
+    :param training_dataset: matrix of training elements
+    :param training_sq_norms: optional precomputed squared norms of the training rows
+    :returns: matrix of shape (number of queries, number of training elements)
+    """
+    if training_sq_norms is None:
+        training_sq_norms = np.einsum('ij,ij->i', training_dataset, training_dataset)
+    test_sq_norms = np.einsum('ij,ij->i', test_matrix, test_matrix)
+
+    sq_distances = np.dot(test_matrix, training_dataset.T)
+    sq_distances *= -2.0
+    sq_distances += test_sq_norms[:, np.newaxis]
+    sq_distances += training_sq_norms
+    # Rounding may leave tiny negative values where the distance is really 0
+    np.maximum(sq_distances, 0.0, out=sq_distances)
+    return sq_distances
+
+
+@instrumented('knn.sort', argument_rows(0))
+def k_nearest(sq_distances, k):
+    """Indices of the k smallest distances of every row, ordered from the closest to the farthest.
+    Uses a partial selection, so only the k selected elements are sorted.
+
+    :param sq_distances: matrix of distances, one row per query
+    :param k: number of neighbors to select
+    :returns: matrix of shape (number of queries, k) with column indices of the neighbors
+    """
+    k = min(k, sq_distances.shape[1])
+    if k < sq_distances.shape[1]:
+        nearest = np.argpartition(sq_distances, k - 1, axis=1)[:, :k]
+    else:
+        nearest = np.tile(np.arange(k), (sq_distances.shape[0], 1))
+    rows = np.arange(sq_distances.shape[0])[:, np.newaxis]
+    order = np.argsort(sq_distances[rows, nearest], axis=1, kind='mergesort')
+    return nearest[rows, order]
+
+
+@instrumented('knn.vote', argument_rows(0))
+def vote(neighbor_codes, num_classes):
+    """Majority vote among the neighbors of every query, with integer encoded classes.
+    Ties are broken in favour of the tied class holding the closest neighbor.
+
+    :param neighbor_codes: matrix of shape (number of queries, k) with the class code of every neighbor, ordered
+     from the closest to the farthest
+    :param num_classes: number of different classes
+    :returns: vector with the winning class code per query
+    """
+    num_queries = neighbor_codes.shape[0]
+    # Offset every row so that a single bincount counts the votes of all the queries
+    offsets = np.arange(num_queries)[:, np.newaxis] * num_classes
+    class_count = np.bincount((neighbor_codes + offsets).ravel(), minlength=num_queries * num_classes)
+    class_count = class_count.reshape(num_queries, num_classes)
+
+    rows = np.arange(num_queries)[:, np.newaxis]
+    is_winner = class_count == class_count.max(axis=1)[:, np.newaxis]
+    # First neighbor, in distance order, that belongs to one of the most voted classes
+    first_winner = is_winner[rows, neighbor_codes].argmax(axis=1)
+    return neighbor_codes[np.arange(num_queries), first_winner]
+
+
+BATCH_SIZE = 256
+
+
+@instrumented('knn.classify', argument_rows(0))
+def classify_batch(test_matrix, training_dataset, training_classes, k, batch_size=BATCH_SIZE):
+    """Classification for kNN algorithm of many vectors at once, using Euclidean distance.
+
+    Queries are processed in batches of batch_size rows, so the distance matrix held in memory is at most
+    batch_size x len(training_dataset).
+
+        >>> import ch2_knn.kNN as knn
+        >>> group, labels = knn.create_dataset()
+        >>> knn.classify_batch(np.array([[0, 0], [1, 1.2]]), group, labels, 3).tolist()
+        ['B', 'A']
+
+    :param test_matrix: matrix of elements to be classified, one per row
+    :param training_dataset: matrix of training elements
+    :param training_classes: vector of classes of the training dataset
+    :param k: number of neighbors to use in the comparison algorithm
+    :param batch_size: number of queries whose distances are computed together
+    :return: vector with the class of every row of test_matrix
+    """
+    test_matrix = np.atleast_2d(np.asarray(test_matrix, dtype=np.float64))
+    training_dataset = np.asarray(training_dataset, dtype=np.float64)
+    classes, training_codes = np.unique(training_classes, return_inverse=True)
 
-    # Number of elements in the training dataset
-    dataset_size = training_dataset.shape[0]
+    result_codes = classify_codes(test_matrix, training_dataset, training_codes.ravel(), len(classes), k,
+                                  batch_size)
+    return classes[result_codes]
 
-    # Distance calculation using Euclidean distance
-    diff_mat = np.tile(test_vector, (dataset_size, 1)) - training_dataset
-    sq_diff_mat = diff_mat**2
-    sq_distances = sq_diff_mat.sum(axis=1)
-    distances = sq_distances**0.5
 
-    # Sorting distances
-    sorted_distances_indices = distances.argsort()
+def classify_codes(test_matrix, training_dataset, training_codes, num_classes, k, batch_size=BATCH_SIZE,
+                   training_sq_norms=None):
+    """Same as classify_batch, but with the classes of the training dataset already integer encoded.
 
-    # Getting k lowest distances
-    class_count = {}
-    for i in range(k):
-        vote_class = training_classes[sorted_distances_indices[i]]
-        class_count[vote_class] = class_count.get(vote_class, 0) + 1
+    :param test_matrix: matrix of elements to be classified, one per row
+    :param training_dataset: matrix of training elements
+    :param training_codes: vector with the class code, from 0 to num_classes - 1, of every training element
+    :param num_classes: number of different classes
+    :param k: number of neighbors to use in the comparison algorithm
+    :param batch_size: number of queries whose distances are computed together
+    :param training_sq_norms: optional precomputed squared norms of the training rows
+    :return: vector with the class code of every row of test_matrix
+    """
+    if training_sq_norms is None:
+        training_sq_norms = np.einsum('ij,ij->i', training_dataset, training_dataset)
 
-    # Sorting output dictionary
-    sorted_class_count = sorted(class_count.iteritems(), key=operator.itemgetter(1), reverse=True)
+    result_codes = np.empty(test_matrix.shape[0], dtype=np.intp)
+    for start in range(0, test_matrix.shape[0], batch_size):
+        end = start + batch_size
+        sq_distances = squared_distances(test_matrix[start:end], training_dataset, training_sq_norms)
+        nearest = k_nearest(sq_distances, k)
+        result_codes[start:end] = vote(training_codes[nearest], num_classes)
 
-    return sorted_class_count[0][0]
+    return result_codes
 
 
+@instrumented('knn.load', result_rows(1))
 def file_to_matrix(filename):
     """Reads a data file and converts it into a matrix
         filename format: field1, field2, field3, class
@@ -102,51 +230,26 @@ def file_to_matrix(filename):
 
 
 def dating_scatter_plot0(dating_matrix):
-    """
-    Scatter plot for dating dataset, without differentiating labels
-
-    plot y = liters of ice cream consumed per week
-    plot x = % time spent playing video games
+    """Scatter plot for dating dataset, without differentiating labels, see knn_plotter.dating_scatter_plot0.
+    matplotlib is only imported when plotting, so headless classifiers do not need it.
 
     :param dating_matrix:
     """
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    ax.scatter(dating_matrix[:, 1], dating_matrix[:, 2])
-    plt.show()
+    from ch2_knn import knn_plotter
+    knn_plotter.dating_scatter_plot0(dating_matrix)
 
 
 def dating_scatter_plot(dating_mat, dating_labels):
-    """Scatter plot for dating dataset, showing labels to make it easier to see the patterns
+    """Scatter plot for dating dataset, showing labels, see knn_plotter.dating_scatter_plot
 
     :param dating_mat: training dataset
     :param dating_labels: clases of the training dataset
     """
-    labels_num = {'didntLike': 0, 'smallDoses': 1, 'largeDoses': 2}
-
-    dating_labels_num = [labels_num[item] for item in dating_labels]
-
-    fig = plt.figure()
-
-    ax = fig.add_subplot(2, 1, 1)
-    ax.set_xlabel('% time spent playing video games')
-    ax.set_ylabel('liters of ice cream consumed per week')
-
-    # plot y = liters of ice cream consumed per week
-    # plot x = % time spent playing video games
-    ax.scatter(dating_mat[:, 1], dating_mat[:, 2], 15.0*np.array(dating_labels_num), 15.0*np.array(dating_labels_num))
-
-    # plot x = frequent flier miles earned per year
-    # plot y = % time spent playing video games
-
-    ax = fig.add_subplot(2, 1, 2)
-    ax.set_xlabel('frequent flier miles earned per year')
-    ax.set_ylabel('% time spent playing video games')
-    ax.scatter(dating_mat[:, 0], dating_mat[:, 1], 15.0*np.array(dating_labels_num), 15.0*np.array(dating_labels_num))
-
-    plt.show()
+    from ch2_knn import knn_plotter
+    knn_plotter.dating_scatter_plot(dating_mat, dating_labels)
 
 
+@instrumented('knn.normalize', argument_rows(0))
 def normalizer(dataset):
     """Normalize the values of a dataset depending on its maximum and minimum values
     :param dataset: dataset to be normalized
@@ -159,12 +262,10 @@ def normalizer(dataset):
     # Get the values ranges per column
     ranges = max_values - min_values
 
-    m = dataset.shape[0]
-    # Tile creates a matrix of the same size of the input, and adds as many tiles (copies of itself)
-    # as marked in the second argument. In this case: min_values.shape=(1x3), and the output is a matrix
-    # of 1000x3, with 1000 copies of min_values
-    norm_dataset = dataset - np.tile(min_values, (m, 1))
-    norm_dataset = norm_dataset/np.tile(ranges, (m, 1))
+    # Broadcasting applies min_values.shape=(1x3) to every row of the dataset, without creating a matrix of
+    # 1000x3 with 1000 copies of min_values. The division is done in place, so there is only one new matrix
+    norm_dataset = np.subtract(dataset, min_values, dtype=np.promote_types(dataset.dtype, np.float32))
+    norm_dataset /= ranges
     return norm_dataset, ranges, min_values
 
 
@@ -174,6 +275,100 @@ DATING_DATASET = 'data/ch2/dating-test-set.txt'
 K = 3
 
 
+class KNNClassifier(object):
+    """kNN classifier fitted once and reused for many predictions.
+
+    Fitting normalizes the training dataset with normalizer and keeps everything needed to classify: min_values
+    and ranges per column, the normalized contiguous training matrix and the integer encoded classes. Predictions
+    do not touch the disk nor recompute any statistic.
+
+        >>> import ch2_knn.kNN as knn
+        >>> group, labels = knn.create_dataset()
+        >>> classifier = knn.KNNClassifier(k=3).fit(group, labels)
+        >>> classifier.predict([[0, 0.2], [0.9, 1]]).tolist()
+        ['B', 'A']
+        >>> classifier.save('/tmp/group.npz')
+        >>> knn.KNNClassifier.load('/tmp/group.npz').predict([[0, 0.2]]).tolist()
+        ['B']
+    """
+
+    def __init__(self, k=K, dtype=np.float64):
+        """
+        :param k: number of neighbors to use in the comparison algorithm
+        :param dtype: float type of the stored training matrix, np.float32 halves its memory
+        """
+        self.k = k
+        self.dtype = np.dtype(dtype)
+        self.min_values = None
+        self.ranges = None
+        self.training_dataset = None
+        self.training_codes = None
+        self.classes = None
+        self._training_sq_norms = None
+
+    def fit(self, dataset, classes):
+        """Normalizes and stores the training dataset.
+
+        :param dataset: matrix of training elements, not normalized
+        :param classes: vector of classes of the training dataset
+        :returns: the classifier itself
+        """
+        norm_dataset, ranges, min_values = normalizer(np.asarray(dataset, dtype=np.float64))
+        self.min_values = min_values
+        self.ranges = ranges
+        self.training_dataset = np.ascontiguousarray(norm_dataset, dtype=self.dtype)
+        self.classes, training_codes = np.unique(classes, return_inverse=True)
+        self.training_codes = training_codes.ravel()
+        self._training_sq_norms = np.einsum('ij,ij->i', self.training_dataset, self.training_dataset)
+        return self
+
+    def normalize(self, matrix):
+        """Normalizes a matrix with the statistics of the training dataset
+
+        :param matrix: matrix of elements, one per row, not normalized
+        :returns: the normalized matrix, in the dtype of the classifier
+        """
+        matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float64))
+        return ((matrix - self.min_values)/self.ranges).astype(self.dtype)
+
+    def predict(self, test_matrix, batch_size=BATCH_SIZE):
+        """Classifies every row of test_matrix.
+
+        :param test_matrix: matrix of elements to be classified, one per row, not normalized
+        :param batch_size: number of queries whose distances are computed together
+        :returns: vector with the class of every row of test_matrix
+        """
+        result_codes = classify_codes(self.normalize(test_matrix), self.training_dataset, self.training_codes,
+                                      len(self.classes), self.k, batch_size, self._training_sq_norms)
+        return self.classes[result_codes]
+
+    def save(self, filename):
+        """Stores the fitted classifier in a single .npz file
+
+        :param filename: output file, '.npz' is appended by numpy if missing
+        """
+        np.savez(filename, k=self.k, min_values=self.min_values, ranges=self.ranges,
+                 training_dataset=self.training_dataset, training_codes=self.training_codes, classes=self.classes)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a classifier stored with save, reading the file only once.
+
+        :param filename: path to the .npz file
+        :returns: fitted classifier
+        """
+        with np.load(filename, allow_pickle=False) as data:
+            classifier = cls(k=int(data['k']), dtype=data['training_dataset'].dtype)
+            classifier.min_values = data['min_values']
+            classifier.ranges = data['ranges']
+            classifier.training_dataset = data['training_dataset']
+            classifier.training_codes = data['training_codes']
+            classifier.classes = data['classes']
+        classifier._training_sq_norms = np.einsum('ij,ij->i', classifier.training_dataset,
+                                                  classifier.training_dataset)
+        return classifier
+
+
 def normalized_classifier_error_rate():
     """Calculate error rate for kNN classifier for a normalized dataset.
     This function uses 90% of the input dataset in training and the other 10% for testing
@@ -190,9 +385,10 @@ def normalized_classifier_error_rate():
 
     error_count = 0.0
 
+    classified_results = classify_batch(norm_dataset[0:num_tests_vectors, :], norm_dataset[num_tests_vectors:m, :],
+                                        dating_labels[num_tests_vectors: m], K)
     for i in range(num_tests_vectors):
-        classified_result = classify(norm_dataset[i, :], norm_dataset[num_tests_vectors:m, :],
-                                     dating_labels[num_tests_vectors: m], K)
+        classified_result = classified_results[i]
         print('The classifier came back with: {}, the real answer is: {}'.format(classified_result, dating_labels[i]))
         if classified_result != dating_labels[i]:
             error_count += 1.0
@@ -227,14 +423,17 @@ def classify_person():
     frequent_flier = float(raw_input("Frequent flier miles earned per year? "))
     ice_cream_liters = float(raw_input("Liters of ice cream consumed per year? "))
 
-    dating_data_mat, dating_labels = file_to_matrix(DATING_DATASET)
-    norm_dataset, ranges, min_values = normalizer(dating_data_mat)
+    # The dataset is read and normalized only the first time
+    if getattr(classify_person, 'classifier', None) is None:
+        dating_data_mat, dating_labels = file_to_matrix(DATING_DATASET)
+        classify_person.classifier = KNNClassifier(K).fit(dating_data_mat, dating_labels)
+
     new_person_definition = np.array([frequent_flier, percent_tats, ice_cream_liters])
-    new_person = (new_person_definition - min_values)/ranges
-    classifier_result = classify(new_person, norm_dataset, dating_labels, K)
+    classifier_result = classify_person.classifier.predict(new_person_definition)[0]
     print("\nYou will probably like this person: {}".format(classifier_result))
 
 
+@instrumented('knn.load')
 def img_to_vector(filename, number_of_pixels=32):
     """Converts an image of 32x32 pixels into a vectorized element of 32x32
 
@@ -253,34 +452,112 @@ def img_to_vector(filename, number_of_pixels=32):
     return result
 
 
+def digits_signature(directory):
+    """Signature of a digits directory, based on the name, size and modification time of every file.
+    It changes whenever a file is added, removed or modified, without opening any of them.
+
+    :param directory: path to the folder with the textual images
+    :returns: hexadecimal string
+    """
+    signature = hashlib.sha1()
+    for filename in sorted(listdir(directory)):
+        stat = os.stat(path.join(directory, filename))
+        signature.update('{}:{}:{!r}\n'.format(filename, stat.st_size, stat.st_mtime).encode('utf-8'))
+    return signature.hexdigest()
+
+
+@instrumented('knn.load', result_rows(1))
+def digits_to_matrix(directory, number_of_pixels=32):
+    """Converts every textual image of a digits directory into a row of a uint8 matrix.
+    Numbers files names are 9_45.txt = num_order.txt
+
+    :param directory: path to the folder with the textual images
+    :param number_of_pixels: number of pixels per side of the square
+    :returns: a matrix with a row of number_of_pixels^2 pixels per image and a vector with the class of every image
+    """
+    filenames = sorted(listdir(directory))
+    number_of_values = number_of_pixels**2
+    digits = np.zeros((len(filenames), number_of_values), dtype=np.uint8)
+    classes = np.zeros(len(filenames), dtype=np.int64)
+
+    for i, filename in enumerate(filenames):
+        classes[i] = int((path.splitext(filename)[0]).split('_')[0])
+        with open(path.join(directory, filename), 'rb') as f:
+            content = np.frombuffer(f.read(), dtype=np.uint8)
+        # Keep only '0' and '1' characters, dropping line breaks
+        digits[i, :] = content[(content == ord('0')) | (content == ord('1'))][:number_of_values] - ord('0')
+
+    return digits, classes
+
+
+def replace_file(filename, write):
+    """Writes a file to a temporary path in its directory and then moves it into place. Processes that still have
+    the old file open or memory-mapped keep reading it, instead of seeing it truncated, and concurrent writers
+    never interleave their content.
+
+    :param filename: path of the file
+    :param write: function that writes the content to the binary file object it receives
+    """
+    temporary_file = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temporary_file, 'wb') as f:
+            write(f)
+        os.replace(temporary_file, filename)
+    finally:
+        if path.exists(temporary_file):
+            os.remove(temporary_file)
+
+
+def load_digits(directory, cache_prefix=None):
+    """Loads a digits directory from its packed binary cache, creating the cache when it does not exist or the
+    directory has changed since it was created.
+
+    The cache consists of three files: {prefix}.digits.npy, with a uint8 row of pixels per image, that is
+    memory-mapped, {prefix}.classes.npy and {prefix}.signature.
+
+        >>> import ch2_knn.kNN as knn
+        >>> digits, classes = knn.load_digits(knn.TRAINING_DATASET)
+
+    :param directory: path to the folder with the textual images
+    :param cache_prefix: path prefix of the cache files, by default the directory path itself
+    :returns: a read only memory-mapped matrix with a row of pixels per image and a vector with their classes
+    """
+    cache_prefix = cache_prefix or directory.rstrip('/\\')
+    digits_file = cache_prefix + '.digits.npy'
+    classes_file = cache_prefix + '.classes.npy'
+    signature_file = cache_prefix + '.signature'
+
+    signature = digits_signature(directory)
+    cached_signature = None
+    if path.exists(signature_file) and path.exists(digits_file) and path.exists(classes_file):
+        with open(signature_file) as f:
+            cached_signature = f.read().strip()
+
+    if cached_signature != signature:
+        digits, classes = digits_to_matrix(directory)
+        replace_file(digits_file, lambda f: np.save(f, digits))
+        replace_file(classes_file, lambda f: np.save(f, classes))
+        # The signature is written last, so an interrupted conversion is never taken as valid
+        replace_file(signature_file, lambda f: f.write(signature.encode('utf-8')))
+
+    return np.load(digits_file, mmap_mode='r'), np.load(classes_file)
+
+
 def handwriting_classify_error_rate():
     """Calculate error rate of kNN algorithm using handwriting dataset.
     normalizer is not needed, values are already normalized from 0 to 1
     Numbers files names are 9_45.txt = num_order.txt
+    Both datasets are read from their packed binary cache, see load_digits.
     """
-    classes = []
-    training_files = listdir(TRAINING_DATASET)
-    # Number of files in training folder
-    number_training_files = len(training_files)
-    training_dataset = np.zeros((number_training_files, 1024))
-
-    i = 0
-    for training_file in training_files:
-        number_class = int((path.splitext(training_file)[0]).split('_')[0])
-        classes.append(number_class)
-        training_dataset[i, :] = img_to_vector(path.join(TRAINING_DATASET, training_file))
-        i += 1
-
-    test_files = listdir(TEST_DATASET)
-    error_count = 0.0
-    for test_file in test_files:
-        number_class = int((path.splitext(test_file)[0]).split('_')[0])
-        test_vector = img_to_vector(path.join(TEST_DATASET, test_file))
-        classifier_result = classify(test_vector, training_dataset, classes, K)
+    training_dataset, classes = load_digits(TRAINING_DATASET)
+    test_dataset, test_classes = load_digits(TEST_DATASET)
+
+    classifier_results = classify_batch(test_dataset, training_dataset, classes, K)
 
+    error_count = 0.0
+    for classifier_result, number_class in zip(classifier_results, test_classes):
         print('The classifier came back with: {}, the real answer is: {}'.format(classifier_result, number_class))
 
         if classifier_result != number_class:
             error_count += 1.0
-    print('Total error rate is: {}'.format(error_count/float(len(test_files))))
-
+    print('Total error rate is: {}'.format(error_count/float(len(test_classes))))
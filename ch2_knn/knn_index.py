@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from ch2_knn import kNN
+
+
+# Above this number of features a KD-tree prunes almost nothing and a brute force scan is faster,
+# as with the 1024 pixels of the handwriting digits
+MAX_TREE_DIMENSIONS = 16
+LEAF_SIZE = 16
+ALGORITHMS = ('auto', 'kd_tree', 'brute')
+
+
+class NeighborsIndex(object):
+    """Reusable index over a training dataset for kNN queries.
+
+    It is built once from the (already normalized) training matrix and its classes. Low dimensional datasets, as
+    the dating one, are indexed with a KD-tree, that answers every query in roughly logarithmic time. High
+    dimensional datasets fall back to a brute force scan.
+
+        >>> import ch2_knn.kNN as knn
+        >>> from ch2_knn.knn_index import NeighborsIndex
+        >>> group, labels = knn.create_dataset()
+        >>> index = NeighborsIndex(group, labels)
+        >>> index.algorithm
+        'kd_tree'
+        >>> index.classify([[0, 0], [1, 1.2]], 3).tolist()
+        ['B', 'A']
+    """
+
+    def __init__(self, training_dataset, training_classes, algorithm='auto', leaf_size=LEAF_SIZE):
+        """
+        :param training_dataset: matrix of training elements
+        :param training_classes: vector of classes of the training dataset
+        :param algorithm: 'kd_tree', 'brute' or 'auto' to choose depending on the number of features
+        :param leaf_size: maximum number of elements in a leaf of the KD-tree
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError('Unknown algorithm {}, expected one of {}'.format(algorithm, ALGORITHMS))
+
+        self.training_dataset = np.ascontiguousarray(training_dataset, dtype=np.float64)
+        self.classes, training_codes = np.unique(training_classes, return_inverse=True)
+        self.training_codes = training_codes.ravel()
+
+        if algorithm == 'auto':
+            algorithm = 'kd_tree' if self.training_dataset.shape[1] <= MAX_TREE_DIMENSIONS else 'brute'
+        self.algorithm = algorithm
+
+        if algorithm == 'kd_tree':
+            self._tree = cKDTree(self.training_dataset, leafsize=leaf_size)
+        else:
+            self._training_sq_norms = np.einsum('ij,ij->i', self.training_dataset, self.training_dataset)
+
+    def query(self, test_matrix, k, batch_size=kNN.BATCH_SIZE):
+        """Finds the k nearest training elements of every row in test_matrix.
+
+        :param test_matrix: matrix of query vectors, one per row
+        :param k: number of neighbors to find
+        :param batch_size: number of queries whose distances are computed together in brute force mode
+        :returns: (squared distances, indices), matrices of shape (number of queries, k) ordered from the closest
+         neighbor to the farthest
+        """
+        test_matrix = np.atleast_2d(np.asarray(test_matrix, dtype=np.float64))
+        k = min(k, self.training_dataset.shape[0])
+
+        if self.algorithm == 'kd_tree':
+            distances, nearest = self._tree.query(test_matrix, k)
+            distances = distances.reshape(-1, k)
+            return distances**2, nearest.reshape(-1, k)
+
+        sq_distances = np.empty((test_matrix.shape[0], k))
+        nearest = np.empty((test_matrix.shape[0], k), dtype=np.intp)
+        for start in range(0, test_matrix.shape[0], batch_size):
+            end = start + batch_size
+            batch_distances = kNN.squared_distances(test_matrix[start:end], self.training_dataset,
+                                                    self._training_sq_norms)
+            batch_nearest = kNN.k_nearest(batch_distances, k)
+            rows = np.arange(batch_nearest.shape[0])[:, np.newaxis]
+            sq_distances[start:end] = batch_distances[rows, batch_nearest]
+            nearest[start:end] = batch_nearest
+        return sq_distances, nearest
+
+    def classify(self, test_matrix, k):
+        """Classifies every row in test_matrix with the majority class of its k nearest neighbors.
+
+        :param test_matrix: matrix of elements to be classified, one per row
+        :param k: number of neighbors to use in the comparison algorithm
+        :returns: vector with the class of every row of test_matrix
+        """
+        _, nearest = self.query(test_matrix, k)
+        return self.classes[kNN.vote(self.training_codes[nearest], len(self.classes))]
+
+
+class LSHIndex(object):
+    """Approximate kNN index for high dimensional datasets, as the 1024 pixels of the handwriting digits, based on
+    random projection locality sensitive hashing.
+
+    Every hash table projects the (centered) elements on num_bits random hyperplanes and keeps the side of every
+    hyperplane as a bit of the key of the element. Close elements tend to share keys, so only the elements with
+    the same key as the query in some table are compared with it. num_tables is the recall knob: more tables find
+    more of the real neighbors, at the cost of more candidates to compare. num_bits is the speed knob: more bits
+    make smaller buckets and fewer candidates, but a lower recall.
+
+        >>> import ch2_knn.kNN as knn
+        >>> from ch2_knn.knn_index import LSHIndex
+        >>> digits, classes = knn.load_digits(knn.TRAINING_DATASET)
+        >>> test_digits, test_classes = knn.load_digits(knn.TEST_DATASET)
+        >>> index = LSHIndex(digits, classes, num_tables=8, num_bits=12)
+        >>> report = index.accuracy_report(test_digits, knn.K)  # doctest: +ELLIPSIS
+        agreement: ...
+        speedup: ...
+    """
+
+    def __init__(self, training_dataset, training_classes, num_tables=8, num_bits=12, seed=0):
+        """
+        :param training_dataset: matrix of training elements
+        :param training_classes: vector of classes of the training dataset
+        :param num_tables: number of hash tables, more tables give a better recall
+        :param num_bits: number of bits of every key, more bits give faster queries
+        :param seed: seed of the random hyperplanes
+        """
+        self.training_dataset = np.ascontiguousarray(training_dataset, dtype=np.float64)
+        self.classes, training_codes = np.unique(training_classes, return_inverse=True)
+        self.training_codes = training_codes.ravel()
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self._training_sq_norms = np.einsum('ij,ij->i', self.training_dataset, self.training_dataset)
+
+        random_state = np.random.RandomState(seed)
+        self._center = self.training_dataset.mean(axis=0)
+        self._hyperplanes = random_state.randn(self.training_dataset.shape[1], num_tables * num_bits)
+        self._powers = 2**np.arange(num_bits, dtype=np.int64)
+
+        # Every table is kept as the training indices sorted by key, buckets are contiguous ranges of it
+        keys = self.hash(self.training_dataset)
+        self._sorted_indices = np.ascontiguousarray(np.argsort(keys, axis=0, kind='mergesort').T)
+        self._sorted_keys = np.ascontiguousarray(np.take_along_axis(keys, self._sorted_indices.T, axis=0).T)
+
+    def hash(self, matrix):
+        """Keys of every row of matrix in every hash table
+
+        :param matrix: matrix of elements, one per row
+        :returns: matrix of shape (number of rows, num_tables) with integer keys
+        """
+        bits = np.dot(matrix - self._center, self._hyperplanes) > 0
+        bits = bits.reshape(matrix.shape[0], self.num_tables, self.num_bits)
+        return np.dot(bits, self._powers)
+
+    def query(self, test_matrix, k):
+        """Finds approximately the k nearest training elements of every row in test_matrix.
+        Candidates sharing a bucket with the query are ranked by their exact distance. When there are less than
+        k candidates, the whole training dataset is scanned for that query.
+
+        :param test_matrix: matrix of query vectors, one per row
+        :param k: number of neighbors to find
+        :returns: (squared distances, indices, number of candidates compared per query). Distances and indices are
+         matrices of shape (number of queries, k) ordered from the closest neighbor to the farthest
+        """
+        test_matrix = np.atleast_2d(np.asarray(test_matrix, dtype=np.float64))
+        k = min(k, self.training_dataset.shape[0])
+        keys = self.hash(test_matrix)
+
+        bucket_starts = np.empty(keys.shape, dtype=np.intp)
+        bucket_ends = np.empty(keys.shape, dtype=np.intp)
+        for table in range(self.num_tables):
+            bucket_starts[:, table] = np.searchsorted(self._sorted_keys[table], keys[:, table], 'left')
+            bucket_ends[:, table] = np.searchsorted(self._sorted_keys[table], keys[:, table], 'right')
+
+        sq_distances = np.empty((test_matrix.shape[0], k))
+        nearest = np.empty((test_matrix.shape[0], k), dtype=np.intp)
+        num_candidates = np.empty(test_matrix.shape[0], dtype=np.intp)
+        full_scans = []
+        for i in range(test_matrix.shape[0]):
+            candidates = np.unique(np.concatenate(
+                [self._sorted_indices[table, bucket_starts[i, table]:bucket_ends[i, table]]
+                 for table in range(self.num_tables)]))
+            if len(candidates) < k:
+                full_scans.append(i)
+                continue
+            num_candidates[i] = len(candidates)
+
+            candidate_distances = kNN.squared_distances(test_matrix[i:i + 1], self.training_dataset[candidates],
+                                                        self._training_sq_norms[candidates])
+            candidate_nearest = kNN.k_nearest(candidate_distances, k)[0]
+            sq_distances[i] = candidate_distances[0, candidate_nearest]
+            nearest[i] = candidates[candidate_nearest]
+
+        # Queries with too few candidates are compared with the whole training dataset, in batches and without
+        # copying it
+        num_candidates[full_scans] = self.training_dataset.shape[0]
+        for start in range(0, len(full_scans), kNN.BATCH_SIZE):
+            batch = full_scans[start:start + kNN.BATCH_SIZE]
+            batch_distances = kNN.squared_distances(test_matrix[batch], self.training_dataset,
+                                                    self._training_sq_norms)
+            batch_nearest = kNN.k_nearest(batch_distances, k)
+            sq_distances[batch] = batch_distances[np.arange(len(batch))[:, np.newaxis], batch_nearest]
+            nearest[batch] = batch_nearest
+
+        return sq_distances, nearest, num_candidates
+
+    def classify(self, test_matrix, k):
+        """Classifies every row in test_matrix with the majority class of its approximate k nearest neighbors.
+
+        :param test_matrix: matrix of elements to be classified, one per row
+        :param k: number of neighbors to use in the comparison algorithm
+        :returns: vector with the class of every row of test_matrix
+        """
+        _, nearest, _ = self.query(test_matrix, k)
+        return self.classes[kNN.vote(self.training_codes[nearest], len(self.classes))]
+
+    def accuracy_report(self, test_matrix, k, test_classes=None):
+        """Compares the approximate search against the exact kNN.classify_batch on the same queries.
+
+        :param test_matrix: matrix of elements to be classified, one per row
+        :param k: number of neighbors to use in the comparison algorithm
+        :param test_classes: optional vector with the real classes of test_matrix, to report both error rates
+        :returns: dict with the recall of the real k nearest neighbors, the agreement between both classifications,
+         the mean fraction of the training dataset compared per query, the time of both searches and the speedup
+        """
+        test_matrix = np.atleast_2d(np.asarray(test_matrix, dtype=np.float64))
+
+        start_time = time.time()
+        _, nearest, num_candidates = self.query(test_matrix, k)
+        approximate_codes = kNN.vote(self.training_codes[nearest], len(self.classes))
+        approximate_time = time.time() - start_time
+
+        start_time = time.time()
+        exact_nearest = np.empty_like(nearest)
+        for start in range(0, test_matrix.shape[0], kNN.BATCH_SIZE):
+            end = start + kNN.BATCH_SIZE
+            exact_nearest[start:end] = kNN.k_nearest(kNN.squared_distances(
+                test_matrix[start:end], self.training_dataset, self._training_sq_norms), k)
+        exact_codes = kNN.vote(self.training_codes[exact_nearest], len(self.classes))
+        exact_time = time.time() - start_time
+
+        found = [len(np.intersect1d(row, exact_row)) for row, exact_row in zip(nearest, exact_nearest)]
+        report = {
+            'recall': np.sum(found)/float(exact_nearest.size),
+            'agreement': np.mean(approximate_codes == exact_codes),
+            'candidates_ratio': np.mean(num_candidates)/float(self.training_dataset.shape[0]),
+            'approximate_time': approximate_time,
+            'exact_time': exact_time,
+            'speedup': exact_time/approximate_time,
+        }
+        if test_classes is not None:
+            test_classes = np.asarray(test_classes)
+            report['approximate_error_rate'] = np.mean(self.classes[approximate_codes] != test_classes)
+            report['exact_error_rate'] = np.mean(self.classes[exact_codes] != test_classes)
+
+        for name in sorted(report):
+            print('{}: {}'.format(name, report[name]))
+        return report
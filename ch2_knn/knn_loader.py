@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Number of rows parsed at once, it bounds the memory used by the parser itself
+CHUNK_ROWS = 100000
+
+
+def count_columns(filename, separator='\t'):
+    """Infers the number of fields of a data file from its first line
+
+    :param filename: path to the data file
+    :param separator: fields separator
+    :returns: number of fields, features plus the class
+    """
+    with open(filename) as f:
+        return len(f.readline().rstrip('\r\n').split(separator))
+
+
+def count_rows(filename):
+    """Counts the non empty lines of a data file, without parsing them
+
+    :param filename: path to the data file
+    :returns: number of rows
+    """
+    with open(filename, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def iter_file_chunks(filename, chunk_rows=CHUNK_ROWS, separator='\t', dtype=np.float64):
+    """Streams a data file in chunks of rows, parsed in bulk by the pandas C parser.
+        filename format: field1, field2, ..., fieldN, class
+
+    :param filename: path to the data file
+    :param chunk_rows: number of rows per chunk
+    :param separator: fields separator
+    :param dtype: float type of the features
+    :returns: generator of (features matrix, vector of classes as strings) per chunk
+    """
+    num_columns = count_columns(filename, separator)
+    num_features = num_columns - 1
+    column_types = dict((i, dtype) for i in range(num_features))
+    column_types[num_features] = str
+
+    reader = pd.read_csv(filename, sep=separator, header=None, names=list(range(num_columns)), dtype=column_types,
+                         na_filter=False, engine='c', chunksize=chunk_rows)
+    for chunk in reader:
+        yield chunk.iloc[:, :num_features].to_numpy(dtype=dtype), chunk[num_features].to_numpy(dtype=str)
+
+
+class ClassEncoder(object):
+    """Integer encoding of the classes of a file read in chunks. Every chunk is encoded as soon as it is read, new
+    classes get the next codes, and renumbering maps them to the codes of the sorted vocabulary, as np.unique does.
+
+        >>> from ch2_knn.knn_loader import ClassEncoder
+        >>> encoder = ClassEncoder()
+        >>> codes = [encoder.encode(['c', 'b', 'c']), encoder.encode(['a', 'b'])]
+        >>> [chunk_codes.tolist() for chunk_codes in codes]
+        [[1, 0, 1], [2, 0]]
+        >>> encoder.renumbering()[codes[0]].tolist()
+        [2, 1, 2]
+        >>> encoder.vocabulary().tolist()
+        ['a', 'b', 'c']
+    """
+
+    def __init__(self):
+        # Code of every class, in the order the chunks are encoded
+        self.class_codes = {}
+
+    def encode(self, chunk_classes, dtype=np.intp):
+        """Codes of the classes of a chunk, new classes get the next codes
+
+        :param chunk_classes: vector of classes
+        :param dtype: integer type of the codes
+        :returns: vector with the code of every class, see renumbering to get the sorted ones
+        """
+        chunk_vocabulary, chunk_codes = np.unique(chunk_classes, return_inverse=True)
+        for clazz in chunk_vocabulary:
+            self.class_codes.setdefault(clazz, len(self.class_codes))
+        to_global = np.array([self.class_codes[clazz] for clazz in chunk_vocabulary], dtype=dtype)
+        return to_global[chunk_codes.ravel()]
+
+    def vocabulary(self):
+        """Sorted vector of the classes seen so far"""
+        return np.array(sorted(self.class_codes), dtype=str)
+
+    def renumbering(self, dtype=np.intp):
+        """Vector mapping every code returned by encode to the index of its class in vocabulary
+
+        :param dtype: integer type of the codes
+        :returns: vector indexed by the codes returned by encode
+        """
+        renumber = np.empty(len(self.class_codes), dtype=dtype)
+        for new_code, clazz in enumerate(self.vocabulary()):
+            renumber[self.class_codes[clazz]] = new_code
+        return renumber
+
+
+def file_to_encoded_matrix(filename, chunk_rows=CHUNK_ROWS, separator='\t', dtype=np.float64):
+    """Reads a data file and converts it into a matrix, with the classes integer encoded.
+    It is a bulk version of kNN.file_to_matrix, for big files with any number of features. The rows are counted
+    first, so every chunk is copied into the final matrix as soon as it is parsed, and the file is never held
+    twice in memory.
+        filename format: field1, field2, ..., fieldN, class
+
+    Execute:
+        >>> import ch2_knn.knn_loader as knn_loader
+        >>> dating_matrix, dating_codes, vocabulary = knn_loader.file_to_encoded_matrix('data/ch2/dating-test-set.txt')
+        >>> str(vocabulary[dating_codes[0]])
+        'largeDoses'
+
+    :param filename: path to the data file
+    :param chunk_rows: number of rows parsed at once
+    :param separator: fields separator
+    :param dtype: float type of the features
+    :returns: a matrix with the examples, a vector with the code of its classes and the sorted vector of classes,
+     so that vocabulary[codes] are the classes of the examples
+    """
+    num_rows = count_rows(filename)
+    matrix = np.empty((num_rows, count_columns(filename, separator) - 1), dtype=dtype)
+    codes = np.empty(num_rows, dtype=np.intp)
+    encoder = ClassEncoder()
+
+    start = 0
+    for chunk_matrix, chunk_classes in iter_file_chunks(filename, chunk_rows, separator, dtype):
+        end = start + chunk_matrix.shape[0]
+        matrix[start:end] = chunk_matrix
+        codes[start:end] = encoder.encode(chunk_classes)
+        start = end
+
+    # Codes are renumbered so that the vocabulary is sorted, as np.unique does
+    np.take(encoder.renumbering(), codes, out=codes)
+    return matrix, codes, encoder.vocabulary()
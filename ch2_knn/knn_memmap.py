@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import numpy as np
+
+from ch2_knn import kNN, knn_loader
+
+
+# Number of training rows whose distances are computed at once, it bounds the memory used by a query
+BLOCK_ROWS = 65536
+
+
+def streaming_min_max(dataset, block_rows=BLOCK_ROWS):
+    """Minimum and range of every column, computed in a single pass over blocks of rows, as needed by normalizer
+
+    :param dataset: matrix, usually an np.memmap, of elements
+    :param block_rows: number of rows read at once
+    :returns: ranges per column, min_values per column
+    """
+    min_values = np.full(dataset.shape[1], np.inf)
+    max_values = np.full(dataset.shape[1], -np.inf)
+    for start in range(0, dataset.shape[0], block_rows):
+        block = dataset[start:start + block_rows]
+        np.minimum(min_values, block.min(0), out=min_values)
+        np.maximum(max_values, block.max(0), out=max_values)
+    return max_values - min_values, min_values
+
+
+def merge_k_nearest(best_distances, best_indices, sq_distances, offset, k):
+    """Merges the running k nearest neighbors of every query with the distances to a new block of training rows
+
+    :param best_distances: matrix (queries x k) with the squared distances of the current k nearest neighbors
+    :param best_indices: matrix (queries x k) with the indices of the current k nearest neighbors
+    :param sq_distances: matrix (queries x block rows) with the squared distances to the new block
+    :param offset: index of the first row of the block in the whole training dataset
+    :param k: number of neighbors to keep
+    :returns: updated (best_distances, best_indices), ordered from the closest to the farthest
+    """
+    rows = np.arange(sq_distances.shape[0])[:, np.newaxis]
+    block_nearest = kNN.k_nearest(sq_distances, k)
+    candidate_distances = np.hstack([best_distances, sq_distances[rows, block_nearest]])
+    candidate_indices = np.hstack([best_indices, block_nearest + offset])
+    nearest = kNN.k_nearest(candidate_distances, k)
+    return candidate_distances[rows, nearest], candidate_indices[rows, nearest]
+
+
+class OutOfCoreClassifier(object):
+    """kNN classifier whose training dataset lives in a memory-mapped file instead of in memory.
+
+    The training dataset is stored not normalized in {prefix}.data.npy. Its normalization statistics are computed
+    in a single streaming pass and stored, with the integer encoded classes, next to it. Queries scan the file in
+    blocks of rows, keeping the running k nearest neighbors of every query, so the memory used depends on the
+    block size and not on the size of the training dataset.
+
+        >>> import ch2_knn.kNN as knn
+        >>> from ch2_knn.knn_memmap import OutOfCoreClassifier
+        >>> group, labels = knn.create_dataset()
+        >>> OutOfCoreClassifier(k=3).fit(group, labels).predict([[0, 0.2], [0.9, 1]]).tolist()
+        ['B', 'A']
+        >>> classifier = OutOfCoreClassifier.from_file('data/ch2/dating-test-set.txt', '/tmp/dating')
+        >>> classifier = OutOfCoreClassifier.open('/tmp/dating')
+        >>> classifier.predict([[40920, 8.3, 0.95]]).tolist()
+        ['largeDoses']
+    """
+
+    def __init__(self, k=kNN.K, block_rows=BLOCK_ROWS):
+        """
+        :param k: number of neighbors to use in the comparison algorithm
+        :param block_rows: number of training rows read at once
+        """
+        self.k = k
+        self.block_rows = block_rows
+        self.training_dataset = None
+        self.training_codes = None
+        self.classes = None
+        self.min_values = None
+        self.ranges = None
+
+    def fit(self, training_dataset, training_classes):
+        """Uses an already memory-mapped training dataset, computing its normalization statistics in a single
+        streaming pass. The training dataset is not copied.
+
+        :param training_dataset: matrix, usually an np.memmap, of training elements, not normalized
+        :param training_classes: vector of classes of the training dataset
+        :returns: the classifier itself
+        """
+        self.training_dataset = training_dataset
+        self.ranges, self.min_values = streaming_min_max(training_dataset, self.block_rows)
+        self.classes, training_codes = np.unique(training_classes, return_inverse=True)
+        self.training_codes = training_codes.ravel()
+        return self
+
+    @classmethod
+    def from_file(cls, filename, prefix, k=kNN.K, chunk_rows=knn_loader.CHUNK_ROWS, dtype=np.float64):
+        """Converts a data file into the memory-mapped files of the classifier, streaming it in chunks.
+        The file is parsed once, while min and max values are computed.
+            filename format: field1, field2, ..., fieldN, class
+
+        :param filename: path to the data file
+        :param prefix: path prefix of the files of the classifier
+        :param k: number of neighbors to use in the comparison algorithm
+        :param chunk_rows: number of rows parsed at once
+        :param dtype: float type of the stored features
+        :returns: the classifier, with the training dataset memory-mapped
+        """
+        num_rows = knn_loader.count_rows(filename)
+        num_features = knn_loader.count_columns(filename) - 1
+        training_dataset = np.lib.format.open_memmap(prefix + '.data.npy', mode='w+', dtype=dtype,
+                                                     shape=(num_rows, num_features))
+        training_codes = np.lib.format.open_memmap(prefix + '.codes.npy', mode='w+', dtype=np.int32,
+                                                   shape=(num_rows,))
+        min_values = np.full(num_features, np.inf)
+        max_values = np.full(num_features, -np.inf)
+        encoder = knn_loader.ClassEncoder()
+
+        start = 0
+        for chunk_matrix, chunk_classes in knn_loader.iter_file_chunks(filename, chunk_rows, dtype=dtype):
+            end = start + chunk_matrix.shape[0]
+            training_dataset[start:end] = chunk_matrix
+            np.minimum(min_values, chunk_matrix.min(0), out=min_values)
+            np.maximum(max_values, chunk_matrix.max(0), out=max_values)
+            training_codes[start:end] = encoder.encode(chunk_classes, np.int32)
+            start = end
+
+        # Codes are renumbered so that the classes are sorted, as np.unique does
+        classes = encoder.vocabulary()
+        renumber = encoder.renumbering(np.int32)
+        for start in range(0, num_rows, chunk_rows):
+            training_codes[start:start + chunk_rows] = renumber[training_codes[start:start + chunk_rows]]
+
+        training_dataset.flush()
+        training_codes.flush()
+        ranges = max_values - min_values
+        np.savez(prefix + '.stats.npz', k=k, classes=classes, min_values=min_values, ranges=ranges)
+        return cls.open(prefix)
+
+    @classmethod
+    def open(cls, prefix, block_rows=BLOCK_ROWS):
+        """Opens the files of a classifier created with from_file, memory-mapping its training dataset
+
+        :param prefix: path prefix of the files of the classifier
+        :param block_rows: number of training rows read at once
+        :returns: the classifier
+        """
+        with np.load(prefix + '.stats.npz', allow_pickle=False) as stats:
+            classifier = cls(int(stats['k']), block_rows)
+            classifier.classes, classifier.min_values, classifier.ranges = (stats['classes'], stats['min_values'],
+                                                                            stats['ranges'])
+        classifier.training_dataset = np.load(prefix + '.data.npy', mmap_mode='r')
+        classifier.training_codes = np.load(prefix + '.codes.npy', mmap_mode='r')
+        return classifier
+
+    def predict(self, test_matrix, block_rows=None):
+        """Classifies every row of test_matrix, with a single scan of the training dataset.
+        Peak memory is about len(test_matrix) x block_rows distances.
+
+        :param test_matrix: matrix of elements to be classified, one per row, not normalized
+        :param block_rows: number of training rows read at once, by default the one of the classifier
+        :returns: vector with the class of every row of test_matrix
+        """
+        block_rows = block_rows or self.block_rows
+        test_matrix = np.atleast_2d(np.asarray(test_matrix, dtype=np.float64))
+        norm_test_matrix = (test_matrix - self.min_values)/self.ranges
+        k = min(self.k, self.training_dataset.shape[0])
+
+        best_distances = np.full((test_matrix.shape[0], k), np.inf)
+        best_indices = np.zeros((test_matrix.shape[0], k), dtype=np.intp)
+        for start in range(0, self.training_dataset.shape[0], block_rows):
+            block = np.array(self.training_dataset[start:start + block_rows], dtype=np.float64)
+            block -= self.min_values
+            block /= self.ranges
+            sq_distances = kNN.squared_distances(norm_test_matrix, block)
+            best_distances, best_indices = merge_k_nearest(best_distances, best_indices, sq_distances, start, k)
+
+        neighbor_codes = np.asarray(self.training_codes[best_indices])
+        return self.classes[kNN.vote(neighbor_codes, len(self.classes))]
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import multiprocessing
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from ch2_knn import kNN
+
+
+Evaluation = namedtuple('Evaluation', ['error_rate', 'confusion_matrix', 'classes', 'timings'])
+
+# State of every worker process, set once by init_worker
+_worker = {}
+
+
+def to_shared_array(matrix):
+    """Copies a matrix into shared memory, that worker processes can read without pickling it
+
+    :param matrix: numpy array
+    :returns: (shared buffer, shape, dtype)
+    """
+    matrix = np.ascontiguousarray(matrix)
+    shared = multiprocessing.RawArray('b', max(matrix.nbytes, 1))
+    np.frombuffer(shared, dtype=matrix.dtype, count=matrix.size).reshape(matrix.shape)[...] = matrix
+    return shared, matrix.shape, matrix.dtype
+
+
+def from_shared_array(shared, shape, dtype):
+    """Numpy view over a matrix copied with to_shared_array, without copying it
+
+    :returns: numpy array
+    """
+    return np.frombuffer(shared, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def init_worker(training, training_codes, test, num_classes, k, batch_size):
+    """Initializer of the worker processes, the shared arrays are received once per worker and not per task"""
+    _worker['training_dataset'] = from_shared_array(*training)
+    _worker['training_codes'] = from_shared_array(*training_codes)
+    _worker['test_matrix'] = from_shared_array(*test)
+    _worker['num_classes'] = num_classes
+    _worker['k'] = k
+    _worker['batch_size'] = batch_size
+    _worker['training_sq_norms'] = np.einsum('ij,ij->i', _worker['training_dataset'], _worker['training_dataset'])
+
+
+def classify_shard(shard):
+    """Task of the worker processes: classifies the rows start:end of the shared test matrix
+
+    :param shard: (start, end) tuple
+    :returns: (start, vector with the class code of every row in the shard)
+    """
+    start, end = shard
+    result_codes = kNN.classify_codes(_worker['test_matrix'][start:end], _worker['training_dataset'],
+                                      _worker['training_codes'], _worker['num_classes'], _worker['k'],
+                                      _worker['batch_size'], _worker['training_sq_norms'])
+    return start, result_codes
+
+
+def evaluate_parallel(test_matrix, test_classes, training_dataset, training_classes, k=kNN.K, processes=None,
+                      shard_rows=kNN.BATCH_SIZE, verbose=False):
+    """Classifies a test dataset with kNN, sharding it across a pool of processes, and measures the errors.
+    The training dataset is placed once in shared memory, instead of being pickled for every task.
+
+        >>> import ch2_knn.kNN as knn
+        >>> from ch2_knn.knn_parallel import evaluate_parallel
+        >>> group, labels = knn.create_dataset()
+        >>> evaluation = evaluate_parallel([[0, 0.2], [1.2, 1.1]], ['A', 'A'], group, labels, k=3, processes=2)
+        >>> evaluation.error_rate
+        0.5
+        >>> evaluation.confusion_matrix.tolist()
+        [[1, 1], [0, 0]]
+
+    :param test_matrix: matrix of elements to be classified, one per row
+    :param test_classes: vector with the real classes of test_matrix
+    :param training_dataset: matrix of training elements
+    :param training_classes: vector of classes of the training dataset
+    :param k: number of neighbors to use in the comparison algorithm
+    :param processes: number of worker processes, by default the number of cores
+    :param shard_rows: number of test rows per task
+    :param verbose: print every classification, as the single threaded error rate functions do
+    :returns: Evaluation with the error rate, the confusion matrix (real classes in rows, predicted classes in
+     columns), the sorted classes that index the confusion matrix and the seconds spent in every phase
+    """
+    timings = {}
+
+    start_time = time.time()
+    test_matrix = np.atleast_2d(np.asarray(test_matrix, dtype=np.float64))
+    training_dataset = np.asarray(training_dataset, dtype=np.float64)
+    classes, codes = np.unique(np.concatenate([np.asarray(training_classes), np.asarray(test_classes)]),
+                               return_inverse=True)
+    codes = codes.ravel()
+    training_codes = codes[:training_dataset.shape[0]]
+    test_codes = codes[training_dataset.shape[0]:]
+    shared = (to_shared_array(training_dataset), to_shared_array(training_codes), to_shared_array(test_matrix))
+    timings['share'] = time.time() - start_time
+
+    start_time = time.time()
+    pool = multiprocessing.Pool(processes, init_worker, shared + (len(classes), k, shard_rows))
+    timings['pool'] = time.time() - start_time
+
+    start_time = time.time()
+    shards = [(start, min(start + shard_rows, test_matrix.shape[0]))
+              for start in range(0, test_matrix.shape[0], shard_rows)]
+    result_codes = np.empty(test_matrix.shape[0], dtype=np.intp)
+    try:
+        for start, shard_codes in pool.imap_unordered(classify_shard, shards):
+            result_codes[start:start + len(shard_codes)] = shard_codes
+    finally:
+        pool.close()
+        pool.join()
+    timings['classify'] = time.time() - start_time
+
+    start_time = time.time()
+    confusion_matrix = np.zeros((len(classes), len(classes)), dtype=np.int64)
+    np.add.at(confusion_matrix, (test_codes, result_codes), 1)
+    errors = len(test_codes) - int(np.trace(confusion_matrix))
+    error_rate = errors/float(max(len(test_codes), 1))
+    timings['aggregate'] = time.time() - start_time
+
+    if verbose:
+        for result_code, test_code in zip(result_codes, test_codes):
+            print('The classifier came back with: {}, the real answer is: {}'.format(classes[result_code],
+                                                                                     classes[test_code]))
+        print('Total error rate is: {}'.format(error_rate))
+
+    return Evaluation(error_rate, confusion_matrix, classes, timings)
+
+
+def normalized_classifier_error_rate(processes=None, verbose=False):
+    """Parallel version of kNN.normalized_classifier_error_rate, using 90% of the dating dataset in training and
+    the other 10% for testing
+
+    :param processes: number of worker processes, by default the number of cores
+    :param verbose: print every classification
+    :returns: Evaluation of the classifier
+    """
+    ho_ratio = 0.10
+    dating_data_mat, dating_labels = kNN.file_to_matrix(kNN.DATING_DATASET)
+    norm_dataset, ranges, min_values = kNN.normalizer(dating_data_mat)
+    num_tests_vectors = int(norm_dataset.shape[0]*ho_ratio)
+
+    return evaluate_parallel(norm_dataset[:num_tests_vectors], dating_labels[:num_tests_vectors],
+                             norm_dataset[num_tests_vectors:], dating_labels[num_tests_vectors:],
+                             processes=processes, verbose=verbose)
+
+
+def handwriting_classify_error_rate(processes=None, verbose=False):
+    """Parallel version of kNN.handwriting_classify_error_rate
+
+    :param processes: number of worker processes, by default the number of cores
+    :param verbose: print every classification
+    :returns: Evaluation of the classifier
+    """
+    training_dataset, classes = kNN.load_digits(kNN.TRAINING_DATASET)
+    test_dataset, test_classes = kNN.load_digits(kNN.TEST_DATASET)
+
+    return evaluate_parallel(test_dataset, test_classes, training_dataset, classes, processes=processes,
+                             verbose=verbose)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def dating_scatter_plot0(dating_matrix):
+    """
+    Scatter plot for dating dataset, without differentiating labels
+
+    plot y = liters of ice cream consumed per week
+    plot x = % time spent playing video games
+
+    :param dating_matrix:
+    """
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.scatter(dating_matrix[:, 1], dating_matrix[:, 2])
+    plt.show()
+
+
+def dating_scatter_plot(dating_mat, dating_labels):
+    """Scatter plot for dating dataset, showing labels to make it easier to see the patterns
+
+    :param dating_mat: training dataset
+    :param dating_labels: clases of the training dataset
+    """
+    labels_num = {'didntLike': 0, 'smallDoses': 1, 'largeDoses': 2}
+
+    dating_labels_num = [labels_num[item] for item in dating_labels]
+
+    fig = plt.figure()
+
+    ax = fig.add_subplot(2, 1, 1)
+    ax.set_xlabel('% time spent playing video games')
+    ax.set_ylabel('liters of ice cream consumed per week')
+
+    # plot y = liters of ice cream consumed per week
+    # plot x = % time spent playing video games
+    ax.scatter(dating_mat[:, 1], dating_mat[:, 2], 15.0*np.array(dating_labels_num), 15.0*np.array(dating_labels_num))
+
+    # plot x = frequent flier miles earned per year
+    # plot y = % time spent playing video games
+
+    ax = fig.add_subplot(2, 1, 2)
+    ax.set_xlabel('frequent flier miles earned per year')
+    ax.set_ylabel('% time spent playing video games')
+    ax.scatter(dating_mat[:, 0], dating_mat[:, 1], 15.0*np.array(dating_labels_num), 15.0*np.array(dating_labels_num))
+
+    plt.show()
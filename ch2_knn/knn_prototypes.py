@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import timeit
+
+import numpy as np
+
+from ch2_knn import kNN
+from ch2_knn.knn_validation import ordered_neighbors
+
+
+# Reductions compared by prototype_report, the first one keeps the whole training dataset
+REDUCTIONS = ['none', 'wilson', 'hart', 'wilson+hart']
+# Highest increase of the error rate, over the one of the whole training dataset, accepted for a reduction
+ERROR_TOLERANCE = 0.01
+
+
+def wilson_editing(dataset, codes, num_classes, k=kNN.K, batch_size=kNN.BATCH_SIZE):
+    """Wilson editing: removes the training elements misclassified by their k nearest neighbors, themselves
+    excluded. It drops the noisy elements and smooths the borders between classes.
+
+    :param dataset: matrix of training elements
+    :param codes: vector with the class code, from 0 to num_classes - 1, of every training element
+    :param num_classes: number of different classes
+    :param k: number of neighbors of the vote
+    :param batch_size: number of elements whose distances are computed together
+    :returns: sorted vector with the indices of the kept elements
+    """
+    nearest = ordered_neighbors(dataset, dataset, k + 1, batch_size)
+    # Every element is usually its own nearest neighbor, but not always with duplicates. A stable sort moves
+    # the element itself to the last column, and the other k columns are its neighbors
+    is_itself = nearest == np.arange(dataset.shape[0])[:, np.newaxis]
+    order = np.argsort(is_itself, axis=1, kind='mergesort')
+    neighbors = nearest[np.arange(dataset.shape[0])[:, np.newaxis], order[:, :k]]
+    return np.flatnonzero(kNN.vote(codes[neighbors], num_classes) == codes)
+
+
+def hart_condensing(dataset, codes, seed=0):
+    """Hart's condensed nearest neighbor: keeps a subset of the training elements that classifies every training
+    element correctly with 1-NN. Elements are visited in order, and the ones misclassified by the kept ones are
+    kept, until a whole pass adds no element. Elements far from the borders between classes are dropped.
+
+    Instead of comparing every element with the kept ones again, the distance to its nearest kept element is
+    updated when a new one is kept, with a single vectorized pass over the dataset.
+
+    :param dataset: matrix of training elements
+    :param codes: vector with the class code of every training element
+    :param seed: seed to shuffle the order of the visits, None keeps the order of the rows
+    :returns: sorted vector with the indices of the kept elements
+    """
+    num_rows = dataset.shape[0]
+    order = np.arange(num_rows)
+    if seed is not None:
+        np.random.RandomState(seed).shuffle(order)
+    sq_norms = np.einsum('ij,ij->i', dataset, dataset)
+
+    is_kept = np.zeros(num_rows, dtype=bool)
+    nearest_distances = np.full(num_rows, np.inf)
+    nearest_codes = np.full(num_rows, -1, dtype=np.intp)
+
+    def keep(row):
+        is_kept[row] = True
+        distances = kNN.squared_distances(dataset[row:row + 1], dataset, sq_norms)[0]
+        closer = distances < nearest_distances
+        nearest_distances[closer] = distances[closer]
+        nearest_codes[closer] = codes[row]
+        # Duplicates with another class could be closer than the element itself, it is never visited again
+        nearest_codes[row] = codes[row]
+
+    keep(order[0])
+    added = True
+    while added:
+        added = False
+        position = 0
+        while True:
+            remaining = order[position:]
+            misclassified = np.flatnonzero((nearest_codes[remaining] != codes[remaining]) & ~is_kept[remaining])
+            if not len(misclassified):
+                break
+            position += misclassified[0]
+            keep(order[position])
+            added = True
+            position += 1
+    return np.flatnonzero(is_kept)
+
+
+def reduce_training_set(dataset, codes, num_classes, reduction, k=kNN.K, seed=0):
+    """Selects the prototypes of a training dataset
+
+    :param dataset: matrix of training elements
+    :param codes: vector with the class code, from 0 to num_classes - 1, of every training element
+    :param num_classes: number of different classes
+    :param reduction: one of REDUCTIONS, 'wilson+hart' condenses the edited dataset
+    :param k: number of neighbors of the Wilson editing vote
+    :param seed: seed of the order of Hart's condensing
+    :returns: sorted vector with the indices of the kept elements
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError('Unknown reduction {}, use one of {}'.format(reduction, ', '.join(REDUCTIONS)))
+    indices = np.arange(dataset.shape[0])
+    if 'wilson' in reduction:
+        indices = indices[wilson_editing(dataset[indices], codes[indices], num_classes, k)]
+    if 'hart' in reduction:
+        indices = indices[hart_condensing(dataset[indices], codes[indices], seed)]
+    return indices
+
+
+def prototype_report(training_dataset, training_classes, test_dataset, test_classes, k=kNN.K,
+                     tolerance=ERROR_TOLERANCE, reductions=REDUCTIONS, repeat=3):
+    """Reduces the training dataset with every reduction and reports the number of kept elements, the reduction
+    ratio, the error rate on the test dataset and the speedup of classify_batch over the whole training dataset.
+
+        >>> import ch2_knn.kNN as knn
+        >>> from ch2_knn.knn_prototypes import prototype_report
+        >>> digits, classes = knn.load_digits(knn.TRAINING_DATASET)
+        >>> test_digits, test_classes = knn.load_digits(knn.TEST_DATASET)
+        >>> report = prototype_report(digits, classes, test_digits, test_classes)  # doctest: +ELLIPSIS
+        reduction          kept  reduction    error  speedup  tolerance
+        none ...
+        wilson+hart ...
+
+    :param training_dataset: matrix of training elements, already normalized
+    :param training_classes: vector of classes of the training dataset
+    :param test_dataset: matrix of elements to be classified, normalized as the training dataset
+    :param test_classes: vector with the real classes of test_dataset
+    :param k: number of neighbors to use in the comparison algorithm
+    :param tolerance: highest increase of the error rate accepted for a reduction
+    :param reductions: list of names of the reductions, see REDUCTIONS
+    :param repeat: number of classifications of the test dataset, the best one is reported
+    :returns: list with a dict per reduction with its name, number of kept elements, reduction ratio, error rate,
+     speedup and whether its error rate is within the tolerance
+    """
+    training_dataset = np.asarray(training_dataset, dtype=np.float64)
+    test_dataset = np.asarray(test_dataset, dtype=np.float64)
+    test_classes = np.asarray(test_classes)
+    classes, codes = np.unique(training_classes, return_inverse=True)
+    codes = codes.ravel()
+
+    report = []
+    print('{:<14} {:>8} {:>10} {:>8} {:>8} {:>10}'.format('reduction', 'kept', 'reduction', 'error', 'speedup',
+                                                          'tolerance'))
+    for reduction in ['none'] + [name for name in reductions if name != 'none']:
+        indices = reduce_training_set(training_dataset, codes, len(classes), reduction, k)
+        prototypes = training_dataset[indices]
+        prototype_codes = codes[indices]
+
+        def classify():
+            return kNN.classify_codes(test_dataset, prototypes, prototype_codes, len(classes), k)
+
+        error_rate = np.mean(classes[classify()] != test_classes)
+        seconds = min(timeit.repeat(classify, number=1, repeat=repeat))
+        if reduction == 'none':
+            base_error_rate, base_seconds = error_rate, seconds
+
+        result = {'name': reduction, 'kept': len(indices),
+                  'reduction_ratio': 1 - len(indices)/float(training_dataset.shape[0]), 'error_rate': error_rate,
+                  'speedup': base_seconds/seconds, 'within_tolerance': error_rate <= base_error_rate + tolerance}
+        if reduction in reductions:
+            report.append(result)
+        print('{:<14} {:>8} {:>10.4f} {:>8.4f} {:>8.2f} {:>10}'.format(
+            reduction, result['kept'], result['reduction_ratio'], error_rate, result['speedup'],
+            'ok' if result['within_tolerance'] else 'exceeded'))
+    return report
+
+
+def dating_prototype_report(tolerance=ERROR_TOLERANCE):
+    """Prototype selection report of the dating dataset, with the hold out of normalized_classifier_error_rate:
+    the first 10% of the normalized rows are classified with the other 90%
+
+    :param tolerance: highest increase of the error rate accepted for a reduction
+    :returns: see prototype_report
+    """
+    dating_data_mat, dating_labels = kNN.file_to_matrix(kNN.DATING_DATASET)
+    norm_dataset = kNN.normalizer(dating_data_mat)[0]
+    num_tests_vectors = int(norm_dataset.shape[0]*0.10)
+    return prototype_report(norm_dataset[num_tests_vectors:], dating_labels[num_tests_vectors:],
+                            norm_dataset[:num_tests_vectors], dating_labels[:num_tests_vectors], tolerance=tolerance)
+
+
+def handwriting_prototype_report(tolerance=ERROR_TOLERANCE):
+    """Prototype selection report of the handwriting dataset, the test digits are classified with the training ones
+
+    :param tolerance: highest increase of the error rate accepted for a reduction
+    :returns: see prototype_report
+    """
+    training_dataset, classes = kNN.load_digits(kNN.TRAINING_DATASET)
+    test_dataset, test_classes = kNN.load_digits(kNN.TEST_DATASET)
+    return prototype_report(training_dataset, classes, test_dataset, test_classes, tolerance=tolerance)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import numpy as np
+
+from ch2_knn import kNN
+
+
+INITIAL_CAPACITY = 64
+# Fraction of the range of a column that the stored values may exceed the normalization statistics by before the
+# store reports that it needs to be renormalized
+DRIFT_TOLERANCE = 0.05
+
+
+class KNNStore(object):
+    """kNN training dataset that changes while it is used: elements are appended and deleted one by one, in
+    amortized constant time, without rebuilding the training matrix.
+
+    Rows are kept in arrays whose capacity doubles when they are full. Deleted rows are only marked as deleted,
+    tombstones, and their squared norm is set to infinity, so no query finds them. The arrays are compacted when
+    there are more tombstones than live rows.
+
+    Rows are normalized when they are written, with the min_values and ranges of the last fit or renormalize, so a
+    new minimum or maximum never changes the stored rows. Instead, the values outside the statistics are tracked,
+    see drift, and renormalize recomputes the statistics and every normalized row when the caller decides to.
+
+        >>> import ch2_knn.kNN as knn
+        >>> from ch2_knn.knn_store import KNNStore
+        >>> group, labels = knn.create_dataset()
+        >>> store = KNNStore(k=3).fit(group, labels)
+        >>> element_id = store.append([1.2, 1.2], 'A')
+        >>> store.delete(element_id)
+        >>> store.predict([[0, 0.2], [0.9, 1]]).tolist()
+        ['B', 'A']
+        >>> if store.needs_renormalize:
+        ...     store.renormalize()
+    """
+
+    def __init__(self, k=kNN.K, capacity=INITIAL_CAPACITY, drift_tolerance=DRIFT_TOLERANCE, dtype=np.float64):
+        """
+        :param k: number of neighbors to use in the comparison algorithm
+        :param capacity: initial number of rows of the arrays
+        :param drift_tolerance: drift above which needs_renormalize is true
+        :param dtype: float type of the normalized training matrix, np.float32 halves its memory
+        """
+        self.k = k
+        self.capacity = capacity
+        self.drift_tolerance = drift_tolerance
+        self.dtype = np.dtype(dtype)
+        self.min_values = None
+        self.ranges = None
+        self._classes = []
+        self._class_codes = {}
+        self._next_id = 0
+        self._slots = {}
+        self._size = 0
+        self.num_deleted = 0
+
+    def fit(self, dataset, classes):
+        """Replaces the content of the store with a training dataset, and normalizes it. The ids of its elements
+        are their row numbers.
+
+        :param dataset: matrix of training elements, not normalized
+        :param classes: vector of classes of the training dataset
+        :returns: the store itself
+        """
+        dataset = np.atleast_2d(np.asarray(dataset, dtype=np.float64))
+        self.min_values = None
+        self.ranges = None
+        self._classes = []
+        self._class_codes = {}
+        self._next_id = 0
+        self._slots = {}
+        self._size = 0
+        self.num_deleted = 0
+        self._allocate(max(self.capacity, dataset.shape[0]), dataset.shape[1])
+        self._write(dataset, classes)
+        self.renormalize()
+        return self
+
+    def __len__(self):
+        """Number of live elements"""
+        return self._size - self.num_deleted
+
+    @property
+    def classes(self):
+        """Vector with every class seen by the store, the class code of an element is its index in it"""
+        return np.array(self._classes)
+
+    def _allocate(self, capacity, dimensions):
+        """Creates the arrays with capacity rows, copying the used ones"""
+        raw = np.zeros((capacity, dimensions))
+        normalized = np.zeros((capacity, dimensions), dtype=self.dtype)
+        sq_norms = np.full(capacity, np.inf)
+        codes = np.zeros(capacity, dtype=np.intp)
+        ids = np.full(capacity, -1, dtype=np.int64)
+        if self._size:
+            raw[:self._size] = self._raw[:self._size]
+            normalized[:self._size] = self._normalized[:self._size]
+            sq_norms[:self._size] = self._sq_norms[:self._size]
+            codes[:self._size] = self._codes[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+        self._raw, self._normalized, self._sq_norms, self._codes, self._ids = raw, normalized, sq_norms, codes, ids
+
+    def _encode(self, classes):
+        """Class code of every class, new classes get the next codes"""
+        codes = []
+        for label in classes:
+            code = self._class_codes.get(label)
+            if code is None:
+                code = self._class_codes[label] = len(self._classes)
+                self._classes.append(label)
+            codes.append(code)
+        return codes
+
+    def _write(self, matrix, classes):
+        """Stores new rows after the used ones, doubling the capacity as many times as needed
+
+        :returns: list with the id of every new element
+        """
+        end = self._size + matrix.shape[0]
+        if end > self._raw.shape[0]:
+            capacity = self._raw.shape[0]
+            while capacity < end:
+                capacity *= 2
+            self._allocate(capacity, self._raw.shape[1])
+
+        ids = list(range(self._next_id, self._next_id + matrix.shape[0]))
+        self._next_id += matrix.shape[0]
+        self._raw[self._size:end] = matrix
+        self._codes[self._size:end] = self._encode(classes)
+        self._ids[self._size:end] = ids
+        self._slots.update(zip(ids, range(self._size, end)))
+        if self.min_values is not None:
+            normalized = self._normalized[self._size:end]
+            normalized[:] = (matrix - self.min_values)/self.ranges
+            self._sq_norms[self._size:end] = np.einsum('ij,ij->i', normalized, normalized)
+            self._seen_min = np.minimum(self._seen_min, matrix.min(0))
+            self._seen_max = np.maximum(self._seen_max, matrix.max(0))
+        self._size = end
+        return ids
+
+    def append(self, vector, label):
+        """Adds an element, normalized with the current statistics
+
+        :param vector: features of the element, not normalized
+        :param label: class of the element
+        :returns: id of the element, to delete it
+        """
+        return self.extend([vector], [label])[0]
+
+    def extend(self, matrix, classes):
+        """Adds several elements, normalized with the current statistics
+
+        :param matrix: matrix of elements, one per row, not normalized
+        :param classes: vector with the class of every element
+        :returns: list with the id of every element
+        """
+        if self.min_values is None:
+            raise ValueError('The store has no normalization statistics, fit it first')
+        return self._write(np.atleast_2d(np.asarray(matrix, dtype=np.float64)), classes)
+
+    def delete(self, element_id):
+        """Removes an element, leaving a tombstone in its row
+
+        :param element_id: id returned when the element was added
+        """
+        slot = self._slots.pop(element_id, None)
+        if slot is None:
+            raise KeyError('Unknown element id {}'.format(element_id))
+        self._sq_norms[slot] = np.inf
+        self._normalized[slot] = 0
+        self._ids[slot] = -1
+        self.num_deleted += 1
+        if self.num_deleted > len(self):
+            self.compact()
+
+    def compact(self):
+        """Removes the tombstones, moving the live rows to the beginning of the arrays"""
+        alive = self._ids[:self._size] >= 0
+        size = int(np.sum(alive))
+        for array in (self._raw, self._normalized, self._sq_norms, self._codes, self._ids):
+            array[:size] = array[:self._size][alive]
+        self._sq_norms[size:self._size] = np.inf
+        self._normalized[size:self._size] = 0
+        self._ids[size:self._size] = -1
+        self._size = size
+        self.num_deleted = 0
+        self._slots = dict(zip(self._ids[:size].tolist(), range(size)))
+
+    def drift(self):
+        """How far the elements added since the last renormalize fall outside the normalization statistics
+
+        Deletions are not taken into account until renormalize, as the minimum or maximum of the live elements
+        could only be found again with a pass over all of them.
+
+        :returns: biggest fraction of the range of a column by which a value exceeds its minimum or maximum
+        """
+        below = (self.min_values - self._seen_min)/self.ranges
+        above = (self._seen_max - (self.min_values + self.ranges))/self.ranges
+        return float(max(below.max(), above.max(), 0.0))
+
+    @property
+    def needs_renormalize(self):
+        """True when the drift is above the drift tolerance"""
+        return self.min_values is not None and self.drift() > self.drift_tolerance
+
+    def renormalize(self):
+        """Removes the tombstones and normalizes every live element again with its own minimum and maximum values"""
+        self.compact()
+        if not self._size:
+            raise ValueError('The store has no elements')
+        normalized, self.ranges, self.min_values = kNN.normalizer(self._raw[:self._size])
+        self._normalized[:self._size] = normalized
+        self._sq_norms[:self._size] = np.einsum('ij,ij->i', self._normalized[:self._size],
+                                                self._normalized[:self._size])
+        self._seen_min = self.min_values
+        self._seen_max = self.min_values + self.ranges
+
+    def normalize(self, matrix):
+        """Normalizes a matrix with the statistics of the store
+
+        :param matrix: matrix of elements, one per row, not normalized
+        :returns: the normalized matrix, in the dtype of the store
+        """
+        matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float64))
+        return ((matrix - self.min_values)/self.ranges).astype(self.dtype)
+
+    def predict(self, test_matrix, batch_size=kNN.BATCH_SIZE):
+        """Classifies every row of test_matrix with the live elements
+
+        :param test_matrix: matrix of elements to be classified, one per row, not normalized
+        :param batch_size: number of queries whose distances are computed together
+        :returns: vector with the class of every row of test_matrix
+        """
+        if not len(self):
+            raise ValueError('The store has no elements')
+        # Tombstones are farther than any live element, they are never among the min(k, live) nearest
+        result_codes = kNN.classify_codes(self.normalize(test_matrix), self._normalized[:self._size],
+                                          self._codes[:self._size], len(self._classes), min(self.k, len(self)),
+                                          batch_size, self._sq_norms[:self._size])
+        return self.classes[result_codes]
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import numpy as np
+
+from ch2_knn import kNN
+
+
+def k_fold_indices(num_rows, folds, seed=None):
+    """Splits the rows of a dataset in folds of (almost) the same size
+
+    :param num_rows: number of rows of the dataset
+    :param folds: number of folds
+    :param seed: seed to shuffle the rows before splitting them, None keeps their order
+    :returns: list with the vector of row indices of every fold
+    """
+    indices = np.arange(num_rows)
+    if seed is not None:
+        np.random.RandomState(seed).shuffle(indices)
+    return np.array_split(indices, folds)
+
+
+def ordered_neighbors(test_matrix, training_dataset, k_max, batch_size=kNN.BATCH_SIZE):
+    """Indices of the k_max nearest training elements of every test row, from the closest to the farthest
+
+    :param test_matrix: matrix of query vectors, one per row
+    :param training_dataset: matrix of training elements
+    :param k_max: number of neighbors to find
+    :param batch_size: number of queries whose distances are computed together
+    :returns: matrix of shape (number of queries, k_max)
+    """
+    training_sq_norms = np.einsum('ij,ij->i', training_dataset, training_dataset)
+    nearest = np.empty((test_matrix.shape[0], min(k_max, training_dataset.shape[0])), dtype=np.intp)
+    for start in range(0, test_matrix.shape[0], batch_size):
+        end = start + batch_size
+        sq_distances = kNN.squared_distances(test_matrix[start:end], training_dataset, training_sq_norms)
+        nearest[start:end] = kNN.k_nearest(sq_distances, k_max)
+    return nearest
+
+
+def errors_per_k(neighbor_codes, test_codes, num_classes):
+    """Number of misclassified rows for every k from 1 to k_max, from a single ordering of the neighbors.
+    The vote for k only looks at the first k columns, so it is the same vote classify would do with k.
+
+    :param neighbor_codes: matrix of shape (number of queries, k_max) with the class code of every neighbor,
+     ordered from the closest to the farthest
+    :param test_codes: vector with the real class code of every query
+    :param num_classes: number of different classes
+    :returns: vector of length k_max, whose item k - 1 is the number of errors with k neighbors
+    """
+    k_max = neighbor_codes.shape[1]
+    errors = np.zeros(k_max, dtype=np.int64)
+    for k in range(1, k_max + 1):
+        errors[k - 1] = np.count_nonzero(kNN.vote(neighbor_codes[:, :k], num_classes) != test_codes)
+    return errors
+
+
+def cross_validate(dataset, classes, k_max, folds=10, normalize=True, seed=0, batch_size=kNN.BATCH_SIZE):
+    """k-fold cross-validation of the kNN classifier for every k from 1 to k_max at once.
+    The neighbors of every row are ordered once per fold, up to k_max, and the error rate of every k is derived
+    from that ordering, so one pass over the distances gives the whole error vs k curve.
+
+        >>> import ch2_knn.kNN as knn
+        >>> import ch2_knn.knn_validation as knn_validation
+        >>> dating_matrix, dating_labels = knn.file_to_matrix(knn.DATING_DATASET)
+        >>> error_rates = knn_validation.cross_validate(dating_matrix, dating_labels, k_max=20)
+        >>> best_k = error_rates.argmin() + 1
+
+    :param dataset: matrix of elements, not normalized
+    :param classes: vector of classes of the dataset
+    :param k_max: biggest number of neighbors to evaluate
+    :param folds: number of folds
+    :param normalize: normalize every fold with the min and max values of its training rows, as normalizer does
+    :param seed: seed to shuffle the rows before splitting them in folds, None keeps their order
+    :param batch_size: number of queries whose distances are computed together
+    :returns: vector of length k_max, whose item k - 1 is the error rate with k neighbors
+    """
+    dataset = np.asarray(dataset, dtype=np.float64)
+    unique_classes, codes = np.unique(classes, return_inverse=True)
+    codes = codes.ravel()
+
+    errors = np.zeros(k_max, dtype=np.int64)
+    for test_indices in k_fold_indices(dataset.shape[0], folds, seed):
+        is_training = np.ones(dataset.shape[0], dtype=bool)
+        is_training[test_indices] = False
+        training_dataset = dataset[is_training]
+        training_codes = codes[is_training]
+        test_matrix = dataset[test_indices]
+
+        if normalize:
+            training_dataset, ranges, min_values = kNN.normalizer(training_dataset)
+            test_matrix = (test_matrix - min_values)/ranges
+
+        nearest = ordered_neighbors(test_matrix, training_dataset, k_max, batch_size)
+        fold_errors = errors_per_k(training_codes[nearest], codes[test_indices], len(unique_classes))
+        # Fewer training rows than k_max: bigger k use all of them, as classify does
+        errors += np.concatenate([fold_errors, np.repeat(fold_errors[-1:], k_max - len(fold_errors))])
+
+    return errors/float(dataset.shape[0])
+
+
+def dating_cross_validation(k_max=20, folds=10):
+    """Error vs k curve of the kNN classifier for the dating dataset, with k-fold cross-validation
+
+    :param k_max: biggest number of neighbors to evaluate
+    :param folds: number of folds
+    :returns: vector of length k_max, whose item k - 1 is the error rate with k neighbors
+    """
+    dating_data_mat, dating_labels = kNN.file_to_matrix(kNN.DATING_DATASET)
+    error_rates = cross_validate(dating_data_mat, dating_labels, k_max, folds)
+    for k, error_rate in enumerate(error_rates, 1):
+        print('k = {}, error rate is: {}'.format(k, error_rate))
+    print('Best k is: {}'.format(error_rates.argmin() + 1))
+    return error_rates
@@ -15,11 +15,41 @@ u"""Copyright 2015 Mariví Peláez
    limitations under the License.
 """
 
+from collections import namedtuple, OrderedDict
+import hashlib
 from math import log
-import operator
 import pickle
 
+import numpy as np
 
+from instrumentation.phases import argument_rows, instrumented
+
+
+# Differences of information gain below this value are rounding errors
+GAIN_TOLERANCE = 1e-10
+# Maximum number of nodes kept by a SplitCache
+CACHE_SIZE = 4096
+
+
+def get_entropy_from_counts(class_counts):
+    """Calculates the Shannon entropy of a dataset from the number of elements of every class:
+        H = -sum(n, i=1)[p(xi)log2p(xi)]
+
+    :param class_counts: iterable with the number of elements of every class
+    :returns: shannon entropy of the dataset
+    """
+    class_counts = list(class_counts)
+    num_entries = float(sum(class_counts))
+
+    shannon_entropy = 0.0
+    for num in class_counts:
+        prob = num/num_entries
+        shannon_entropy -= prob * log(prob, 2)
+
+    return shannon_entropy
+
+
+@instrumented('trees.entropy', argument_rows(0))
 def get_shannon_entropy(dataset):
     """Calculates the Shannon entropy of a given dataset:
         H = -sum(n, i=1)[p(xi)log2p(xi)]
@@ -34,18 +64,9 @@ def get_shannon_entropy(dataset):
     for item in dataset:
         # Get the class of the item, that is in the last element of the list
         current_class = item[-1]
-        if current_class not in num_classes.keys():
-            num_classes[current_class] = 0
-
-        num_classes[current_class] += 1
-
-    shannon_entropy = 0.0
-    num_entries = len(dataset)
-    for clazz, num in num_classes.items():
-        prob = float(num)/num_entries
-        shannon_entropy -= prob * log(prob, 2)
+        num_classes[current_class] = num_classes.get(current_class, 0) + 1
 
-    return shannon_entropy
+    return get_entropy_from_counts(num_classes.values())
 
 
 def get_simple_dataset():
@@ -70,6 +91,29 @@ def get_simple_dataset():
     return dataset, features
 
 
+LENSES_DATASET = 'data/ch3/lenses.data'
+LENSES_LABELS = ['age', 'prescript', 'astigmatic', 'tear rate']
+
+
+def get_lenses_dataset(filename=LENSES_DATASET):
+    """Lenses dataset, from http://archive.ics.uci.edu/ml/machine-learning-databases/lenses/
+    Every line has an identifier, the four features and the class, separated by spaces.
+
+        >>> import ch3_trees.trees as trees
+        >>> dataset, features = trees.get_lenses_dataset()
+        >>> dataset[0], features
+        (['1', '1', '1', '1', '3'], ['age', 'prescript', 'astigmatic', 'tear rate'])
+
+    :param filename: path to the lenses data file
+    :returns: (dataset, features) as in get_simple_dataset
+    """
+    with open(filename) as f:
+        # Drop the identifier of every line
+        dataset = [line.split()[1:] for line in f if line.strip()]
+    return dataset, list(LENSES_LABELS)
+
+
+@instrumented('trees.split_dataset', argument_rows(0))
 def split_dataset(dataset, axis, axis_value):
     """Split the given dataset for the feature in axis, and taken into account its value in axis_value.
 
@@ -97,6 +141,38 @@ def split_dataset(dataset, axis, axis_value):
     return reduced_dataset
 
 
+def get_split_counts(dataset):
+    """Counts, in a single pass over the dataset, the elements of every class for every value of every feature.
+    These histograms are all that is needed to score the splits of a node, without building the splitted datasets.
+
+        >>> import ch3_trees.trees as trees
+        >>> dataset, features = trees.get_simple_dataset()
+        >>> class_counts, split_counts = trees.get_split_counts(dataset)
+        >>> class_counts == {'yes': 2, 'no': 3}
+        True
+        >>> split_counts[0] == {1: {'yes': 2, 'no': 1}, 0: {'no': 2}}
+        True
+
+    :param dataset: list of lists. All the lists are of the same length. The last item in the list is the class
+    of the element.
+    :returns: (class_counts, split_counts). class_counts is a dict with the number of elements per class, and
+     split_counts a list with a dict per feature, {feature value: {class: number of elements}}
+    """
+    num_features = len(dataset[0]) - 1
+    class_counts = {}
+    split_counts = [{} for _ in range(num_features)]
+
+    for item in dataset:
+        current_class = item[-1]
+        class_counts[current_class] = class_counts.get(current_class, 0) + 1
+        for i in range(num_features):
+            value_counts = split_counts[i].setdefault(item[i], {})
+            value_counts[current_class] = value_counts.get(current_class, 0) + 1
+
+    return class_counts, split_counts
+
+
+@instrumented('trees.choose_split', argument_rows(0))
 def choose_best_splitting_feature(dataset):
     """Loops recursively through the whole dataset to determine the best feature to split it
 
@@ -107,32 +183,31 @@ def choose_best_splitting_feature(dataset):
 
      This means that the feature in the first position (0) has the higher information gain.
 
+    The entropy of every split is calculated from class histograms, see get_split_counts, so no splitted dataset
+    is built while scoring the features.
+
     :param dataset: list of lists. All the lists are of the same length. The last item in the list is the class
     of the element. There is no assumptions on the type of the data.
     :return: index of the best splitter feature of the dataset
     """
 
-    # Do not count the class of the element in the number of features of the dataset
-    num_features = len(dataset[0]) - 1
+    class_counts, split_counts = get_split_counts(dataset)
+    num_entries = float(len(dataset))
     # Entropy of the whole dataset without any splitting, latter use in comparisons
-    base_entropy = get_shannon_entropy(dataset)
+    base_entropy = get_entropy_from_counts(class_counts.values())
     best_info_gain = 0.0
     best_feature = -1
 
-    for i in range(num_features):
-        # Creates a list with all the possible values of the feature i
-        features_list = [item[i] for item in dataset]
-        # Removes duplicate values
-        unique_values = set(features_list)
+    for i, feature_counts in enumerate(split_counts):
         # Contains the entropy of the splitted dataset
         current_entropy = 0.0
-        for value in unique_values:
-            splitted_dataset = split_dataset(dataset, i, value)
-            prob = len(splitted_dataset)/float(len(dataset))
+        for value_counts in feature_counts.values():
+            prob = sum(value_counts.values())/num_entries
             # Sum up entropy for all the unique values of the feature in analysis
-            current_entropy += prob * get_shannon_entropy(splitted_dataset)
+            current_entropy += prob * get_entropy_from_counts(value_counts.values())
         info_gain = base_entropy - current_entropy
-        if info_gain > best_info_gain:
+        # Features that tie, but for rounding errors, keep the first one
+        if info_gain > best_info_gain + GAIN_TOLERANCE:
             best_info_gain = info_gain
             best_feature = i
     return best_feature
@@ -144,14 +219,17 @@ def get_majority_class(classes):
     :return: the class that happens the most
     """
     num_class = {}
+    seen_classes = []
     for clazz in classes:
-        if clazz not in num_class.keys():
+        if clazz not in num_class:
             num_class[clazz] = 0
-        num_class += 1
-    sorted_num_class = sorted(num_class.iteritems(), key=operator.itemgetter(1), reverse=True)
-    return sorted_num_class[0][0]
+            seen_classes.append(clazz)
+        num_class[clazz] += 1
+    # max keeps the first of the tied classes, so ties go to the class seen first
+    return max(seen_classes, key=num_class.get)
 
 
+@instrumented('trees.build', argument_rows(0))
 def create_tree(dataset, labels):
     """Creates a decision tree based on ID3, for the given dataset.
 
@@ -181,6 +259,9 @@ def create_tree(dataset, labels):
 
     # In any other case let's calculate tree
     best_feature = choose_best_splitting_feature(dataset)
+    # No feature gives any information, e.g. equal elements of different classes
+    if best_feature == -1:
+        return get_majority_class(classes_list)
     best_feature_class = feature_names[best_feature]
 
     tree = {best_feature_class: {}}
@@ -200,24 +281,519 @@ def create_tree(dataset, labels):
 
     return tree
 
+
+class NumericBranch(namedtuple('NumericBranch', ['operator', 'threshold'])):
+    """Key of the two branches of a split on a numeric feature, NumericBranch('<=', t) and NumericBranch('>', t).
+
+        >>> import ch3_trees.trees as trees
+        >>> branch = trees.NumericBranch('<=', 2.5)
+        >>> str(branch), branch.matches(2), branch.matches(3)
+        ('<= 2.5', True, False)
+    """
+    __slots__ = ()
+
+    def matches(self, value):
+        """Checks whether a value goes down this branch"""
+        if self.operator == '<=':
+            return value <= self.threshold
+        return value > self.threshold
+
+    def __str__(self):
+        return '{} {:g}'.format(self.operator, self.threshold)
+
+
+@instrumented('trees.encode', argument_rows(0))
+def encode_dataset(dataset, features=None):
+    """Encodes the features and the class of a dataset as integer codes, in order of appearance.
+
+        >>> import ch3_trees.trees as trees
+        >>> dataset, features = trees.get_simple_dataset()
+        >>> feature_codes, class_codes, feature_values, classes = trees.encode_dataset(dataset)
+        >>> feature_codes[:, 0].tolist(), class_codes.tolist(), feature_values[0], classes
+        ([0, 0, 0, 1, 1], [0, 0, 1, 1, 1], [1, 0], ['yes', 'no'])
+
+    :param dataset: list of lists. All the lists are of the same length. The last item in the list is the class
+    of the element.
+    :param features: list with the column index of the features to encode, all of them by default
+    :returns: (feature_codes, class_codes, feature_values, classes). feature_codes is an integer matrix with a row
+     per element and a column per encoded feature, class_codes an integer vector with the class of every element,
+     feature_values a list with the values of every encoded feature, indexed by their code, and classes the list of
+     classes, indexed by their code.
+    """
+    if features is None:
+        features = list(range(len(dataset[0]) - 1))
+    feature_codes = np.empty((len(dataset), len(features)), dtype=np.intp)
+    value_codes = [{} for _ in features]
+    class_indices = {}
+
+    for i, feature in enumerate(features):
+        codes = value_codes[i]
+        feature_codes[:, i] = [codes.setdefault(item[feature], len(codes)) for item in dataset]
+    class_codes = np.array([class_indices.setdefault(item[-1], len(class_indices)) for item in dataset],
+                           dtype=np.intp)
+
+    feature_values = [sorted(codes, key=codes.get) for codes in value_codes]
+    classes = sorted(class_indices, key=class_indices.get)
+    return feature_codes, class_codes, feature_values, classes
+
+
+def get_entropies_from_count_matrix(counts):
+    """Shannon entropy of every row of a matrix of class counts, as get_entropy_from_counts
+
+    :param counts: integer matrix with a row per group of elements and a column per class
+    :returns: (vector with the entropy of every row, vector with the number of elements of every row)
+    """
+    totals = counts.sum(axis=1)
+    probs = counts / np.maximum(totals, 1)[:, np.newaxis].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plogp = np.where(probs > 0, probs * np.log2(probs), 0.0)
+    return -plogp.sum(axis=1), totals
+
+
+def get_encoded_split_entropies(node_codes, class_codes, value_offsets, num_classes):
+    """Entropy of the split of a node by every feature, from the class histogram of every value of every feature.
+    All the histograms are built with a single bincount, as every feature has its own range of value slots.
+
+    :param node_codes: integer matrix with the encoded features of the elements of the node
+    :param class_codes: vector with the class code of every element of the node
+    :param value_offsets: vector with the first value slot of every feature, plus the total number of slots
+    :param num_classes: number of different classes
+    :returns: (vector with the entropy of the split by every feature, matrix of class counts with a row per value
+     slot)
+    """
+    slots = (node_codes + value_offsets[:-1]) * num_classes + class_codes[:, np.newaxis]
+    counts = np.bincount(slots.ravel(), minlength=value_offsets[-1] * num_classes)
+    counts = counts.reshape(value_offsets[-1], num_classes)
+
+    entropies, value_totals = get_entropies_from_count_matrix(counts)
+    weighted_entropies = value_totals * entropies / float(len(class_codes))
+    return np.add.reduceat(weighted_entropies, value_offsets[:-1]), counts
+
+
+def get_threshold_split(sorted_values, sorted_classes, num_classes, max_thresholds=None):
+    """Best binary split of a node by a numeric feature, value <= threshold against value > threshold.
+    The class counts at the left of every cut are the cumulative sum of the classes sorted by value, so all the
+    cuts are scored in a single pass.
+
+        >>> import numpy as np
+        >>> import ch3_trees.trees as trees
+        >>> values, classes = np.array([1.0, 2.0, 3.0, 4.0]), np.array([0, 0, 1, 1])
+        >>> split_entropy, threshold, num_left = trees.get_threshold_split(values, classes, 2)
+        >>> threshold, num_left
+        (2.5, 2)
+
+    :param sorted_values: vector with the value of the feature of every element of the node, in ascending order
+    :param sorted_classes: vector with the class code of every element, in the same order
+    :param num_classes: number of different classes
+    :param max_thresholds: maximum number of cuts to score. When there are more, only the cuts closest to
+     max_thresholds quantiles of the values are scored. All of them by default.
+    :returns: (entropy of the split, threshold, number of elements at the left of the cut), or None when all the
+     values are equal
+    """
+    num_entries = len(sorted_values)
+    # A cut after position i is only possible between different values
+    cuts = np.flatnonzero(sorted_values[:-1] < sorted_values[1:])
+    if not len(cuts):
+        return None
+    if max_thresholds is not None and len(cuts) > max_thresholds:
+        quantiles = np.arange(1, max_thresholds + 1) * num_entries // (max_thresholds + 1)
+        cuts = np.unique(cuts[np.minimum(np.searchsorted(cuts, quantiles), len(cuts) - 1)])
+
+    left_counts = np.zeros((num_entries, num_classes), dtype=np.intp)
+    left_counts[np.arange(num_entries), sorted_classes] = 1
+    np.cumsum(left_counts, axis=0, out=left_counts)
+    left_counts = left_counts[cuts]
+    right_counts = np.bincount(sorted_classes, minlength=num_classes) - left_counts
+
+    left_entropies, left_totals = get_entropies_from_count_matrix(left_counts)
+    right_entropies, right_totals = get_entropies_from_count_matrix(right_counts)
+    split_entropies = (left_totals * left_entropies + right_totals * right_entropies) / float(num_entries)
+
+    best = np.argmin(split_entropies)
+    lower, upper = sorted_values[cuts[best]], sorted_values[cuts[best] + 1]
+    threshold = lower + (upper - lower) / 2.0
+    # The middle point of two consecutive floats may be rounded up to the upper one
+    if not threshold < upper:
+        threshold = lower
+    return float(split_entropies[best]), float(threshold), int(cuts[best]) + 1
+
+
+def get_encoded_majority_class(class_codes, num_classes):
+    """Gets the class code that happens the most, ties go to the class seen first as in get_majority_class
+
+    :param class_codes: vector of class codes
+    :param num_classes: number of different classes
+    :returns: the class code that happens the most
+    """
+    counts = np.bincount(class_codes, minlength=num_classes)
+    is_majority = counts == counts.max()
+    return class_codes[np.argmax(is_majority[class_codes])]
+
+
+class SplitCache(object):
+    """Least recently used cache of the statistics of the nodes of EncodedTreeBuilder: entropy, class counts of
+    every feature value and best thresholds. Nodes are identified by a hash of their rows, so the same rows reached
+    again, e.g. when the same dataset is built with different limits, are not scored again. No node is scored twice
+    within a single build, so a cache only pays off when it is shared by several builds.
+
+    A cache must only be shared by builders of the same dataset.
+
+        >>> import ch3_trees.trees as trees
+        >>> dataset, features = trees.get_simple_dataset()
+        >>> cache = trees.SplitCache()
+        >>> tree = trees.create_tree_encoded(dataset, features, cache=cache)
+        >>> tree = trees.create_tree_encoded(dataset, features, cache=cache)
+        >>> cache.hits, cache.misses
+        (2, 2)
+    """
+
+    def __init__(self, max_size=CACHE_SIZE):
+        """
+        :param max_size: maximum number of nodes kept, the least recently used ones are evicted first
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(rows):
+        """Stable hash of the rows of a node, whatever their order
+
+        :param rows: vector with the indices of the rows of the node
+        :returns: bytes
+        """
+        return hashlib.sha1(np.sort(np.asarray(rows, dtype=np.int64)).tobytes()).digest()
+
+    def get(self, key):
+        """Statistics stored for a node, marking them as the most recently used
+
+        :param key: key of the rows of the node
+        :returns: the statistics, or None when they are not in the cache
+        """
+        statistics = self._entries.pop(key, None)
+        if statistics is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = statistics
+        return statistics
+
+    def put(self, key, statistics):
+        """Stores the statistics of a node, evicting the least recently used ones when the cache is full
+
+        :param key: key of the rows of the node
+        :param statistics: statistics of the node
+        """
+        self._entries[key] = statistics
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        """Fraction of the lookups found in the cache"""
+        lookups = self.hits + self.misses
+        return self.hits/float(lookups) if lookups else 0.0
+
+
+def statistics_rows(args, result):
+    """Rows processed by EncodedTreeBuilder.choose_split: the rows of the node its statistics belong to"""
+    return int(args[2]['class_counts'].sum())
+
+
+class EncodedTreeBuilder(object):
+    """ID3 builder over a dataset encoded once as integer arrays, see create_tree_encoded.
+    Every node is an array with the indices of its rows, instead of a copy of them.
+
+    Numeric features are split in two by a threshold instead of in a branch per value. Every numeric column is
+    sorted once for the whole dataset, and every node keeps its rows in the order of every numeric column, so the
+    best threshold is found with a linear scan and no sort per node.
+
+    The builder can be reused to build many trees from the same encoded dataset, on different samples of its rows,
+    and considering a random subset of the features in every node, as the trees of a random forest.
+
+    The growth of the tree can be limited with max_depth, min_samples_split and min_info_gain: nodes reaching any
+    of the limits become leaves with their majority class.
+    """
+
+    def __init__(self, dataset, labels, numeric_features=(), max_thresholds=None, max_features=None,
+                 random_state=None, max_depth=None, min_samples_split=2, min_info_gain=0.0, cache=None):
+        """
+        :param dataset: list of lists. All the lists are of the same length. The last item in the list is the class
+        of the element.
+        :param labels: a list containing a name for each feature
+        :param numeric_features: labels of the features with numeric values, split by thresholds
+        :param max_thresholds: maximum number of thresholds scored per numeric feature and node, see
+         get_threshold_split
+        :param max_features: number of features, chosen at random, scored in every node. All of them by default.
+        :param random_state: seed of the random choice of features
+        :param max_depth: maximum number of decision nodes from the root to a leaf, unlimited by default
+        :param min_samples_split: minimum number of rows of a node to be split
+        :param min_info_gain: minimum information gain of a split
+        :param cache: optional SplitCache with the statistics of the nodes, shared by builders of the same dataset
+        """
+        self.labels = list(labels)
+        self.max_thresholds = max_thresholds
+        self.max_features = max_features
+        self.random_state = np.random.RandomState(random_state)
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_info_gain = min_info_gain
+        self.cache = cache
+        numeric = set(self.labels.index(label) for label in numeric_features)
+        categorical = [feature for feature in range(len(self.labels)) if feature not in numeric]
+        self.numeric_features = sorted(numeric)
+
+        # Column of every feature in feature_codes, for categorical features, or in numeric_values
+        self.columns = dict((feature, column) for column, feature in enumerate(categorical))
+        self.columns.update((feature, column) for column, feature in enumerate(self.numeric_features))
+
+        self.feature_codes, self.class_codes, feature_values, self.classes = encode_dataset(dataset, categorical)
+        self.feature_values = dict(zip(categorical, feature_values))
+        self.value_offsets = np.cumsum([0] + [len(values) for values in feature_values])
+        self.numeric_values = np.array([[item[feature] for feature in self.numeric_features] for item in dataset],
+                                       dtype=np.float64).reshape(len(dataset), len(self.numeric_features))
+        # Branch of every row in the split being done, to keep the order of the numeric columns in the children
+        self._row_branches = np.empty(len(dataset), dtype=np.intp)
+
+    def build(self, rows=None):
+        """Creates the decision tree of the dataset
+
+        :param rows: vector with the indices of the rows to build the tree from, repeated rows count as many times
+         as they appear, e.g. a bootstrap sample. All the rows of the dataset by default.
+        :return: decision tree in the form of nested dictionaries.
+        """
+        if rows is None:
+            rows = np.arange(len(self.class_codes))
+        rows = np.asarray(rows, dtype=np.intp)
+        sorted_rows = [rows[np.argsort(self.numeric_values[rows, column], kind='mergesort')]
+                       for column in range(len(self.numeric_features))]
+        return self.build_node(rows, list(range(len(self.labels))), sorted_rows)
+
+    def split_sorted_rows(self, sorted_rows, branch_rows):
+        """Splits the rows of a node sorted by every numeric column into the rows of its children, keeping the order
+
+        :param sorted_rows: list with the rows of the node sorted by every numeric column
+        :param branch_rows: list with the rows of every child
+        :returns: list with the sorted_rows of every child
+        """
+        for branch, rows in enumerate(branch_rows):
+            self._row_branches[rows] = branch
+        children_sorted_rows = [[] for _ in branch_rows]
+        for rows in sorted_rows:
+            row_branches = self._row_branches[rows]
+            for branch, child_sorted_rows in enumerate(children_sorted_rows):
+                child_sorted_rows.append(rows[row_branches == branch])
+        return children_sorted_rows
+
+    def get_node_statistics(self, rows, node_classes, class_counts=None):
+        """Entropy of a node and class counts of every value of every categorical feature, from the cache when
+        there is one
+
+        :param rows: vector with the indices of the rows of the node
+        :param node_classes: vector with the class code of every row of the node
+        :param class_counts: vector with the number of rows of every class, counted when it is not given
+        :returns: dict with the class_counts and base_entropy of the node, the split_entropies and counts of
+         get_encoded_split_entropies, and the thresholds of the numeric features, filled by choose_split
+        """
+        if self.cache is not None:
+            key = self.cache.key(rows)
+            statistics = self.cache.get(key)
+            if statistics is not None:
+                return statistics
+
+        num_classes = len(self.classes)
+        if class_counts is None:
+            class_counts = np.bincount(node_classes, minlength=num_classes)
+        split_entropies, counts = get_encoded_split_entropies(self.feature_codes[rows], node_classes,
+                                                              self.value_offsets, num_classes)
+        statistics = {'class_counts': class_counts,
+                      'base_entropy': get_entropy_from_counts(class_counts[class_counts > 0]),
+                      'split_entropies': split_entropies, 'counts': counts, 'thresholds': {}}
+        if self.cache is not None:
+            self.cache.put(key, statistics)
+        return statistics
+
+    @instrumented('trees.choose_split', statistics_rows)
+    def choose_split(self, features, statistics, sorted_rows):
+        """Chooses the feature of a node with the highest information gain
+
+        :param features: list with the column index of the features to score
+        :param statistics: statistics of the node, see get_node_statistics
+        :param sorted_rows: list with the rows of the node sorted by every numeric column
+        :returns: (best feature, (threshold, number of rows at its left) for numeric features or None), the best
+         feature is None when no feature gives more information than min_info_gain
+        """
+        best_info_gain = self.min_info_gain
+        best_feature = None
+        best_threshold = None
+        thresholds = statistics['thresholds']
+        for feature in features:
+            column = self.columns[feature]
+            threshold_split = None
+            if feature in self.feature_values:
+                split_entropy = statistics['split_entropies'][column]
+            else:
+                if (column, self.max_thresholds) not in thresholds:
+                    thresholds[column, self.max_thresholds] = get_threshold_split(
+                        self.numeric_values[sorted_rows[column], column], self.class_codes[sorted_rows[column]],
+                        len(self.classes), self.max_thresholds)
+                threshold_split = thresholds[column, self.max_thresholds]
+                if threshold_split is None:
+                    continue
+                split_entropy = threshold_split[0]
+            info_gain = statistics['base_entropy'] - split_entropy
+            if info_gain > best_info_gain + GAIN_TOLERANCE:
+                best_info_gain = info_gain
+                best_feature = feature
+                best_threshold = threshold_split[1:] if threshold_split is not None else None
+        return best_feature, best_threshold
+
+    @instrumented('trees.build', argument_rows(1))
+    def build_node(self, rows, features, sorted_rows=(), depth=0, class_counts=None):
+        """Recursive step of the builder
+
+        :param rows: vector with the indices of the rows of the node
+        :param features: list with the column index of the features not yet used in the branch. Numeric features
+         can be used again, with another threshold.
+        :param sorted_rows: list with the rows of the node sorted by every numeric column
+        :param depth: number of decision nodes above the node
+        :param class_counts: vector with the number of rows of every class, when its parent already knows it
+        :returns: decision tree of the node in the form of nested dictionaries
+        """
+        node_classes = self.class_codes[rows]
+        num_classes = len(self.classes)
+
+        # Check if all element are of the same class, then stop
+        if (node_classes == node_classes[0]).all():
+            return self.classes[node_classes[0]]
+
+        # When no more features, or the node is too deep or too small to be split, return majority
+        if not features or len(rows) < self.min_samples_split or \
+                (self.max_depth is not None and depth >= self.max_depth):
+            return self.classes[get_encoded_majority_class(node_classes, num_classes)]
+
+        statistics = self.get_node_statistics(rows, node_classes, class_counts)
+        candidates = features
+        if self.max_features is not None and len(features) > self.max_features:
+            chosen = np.sort(self.random_state.choice(len(features), self.max_features, replace=False))
+            candidates = [features[i] for i in chosen]
+        best_feature, best_threshold = self.choose_split(candidates, statistics, sorted_rows)
+        # When none of the random features gives any information, the rest of them are tried too
+        if best_feature is None and len(candidates) < len(features):
+            best_feature, best_threshold = self.choose_split(
+                [feature for feature in features if feature not in candidates], statistics, sorted_rows)
+
+        # No feature gives any information, e.g. equal elements of different classes
+        if best_feature is None:
+            return self.classes[get_encoded_majority_class(node_classes, num_classes)]
+
+        best_feature_class = self.labels[best_feature]
+        column = self.columns[best_feature]
+        tree = {best_feature_class: {}}
+
+        if best_threshold is not None:
+            threshold, num_left = best_threshold
+            branches = [NumericBranch('<=', threshold), NumericBranch('>', threshold)]
+            branch_rows = [sorted_rows[column][:num_left], sorted_rows[column][num_left:]]
+            remaining_features = features
+            left_counts = np.bincount(self.class_codes[branch_rows[0]], minlength=num_classes)
+            children_class_counts = [left_counts, statistics['class_counts'] - left_counts]
+        else:
+            # Rows of every value are contiguous once sorted by the value code
+            value_rows = rows[np.argsort(self.feature_codes[rows, column], kind='mergesort')]
+            value_class_counts = statistics['counts'][self.value_offsets[column]:self.value_offsets[column + 1]]
+            branches = []
+            branch_rows = []
+            children_class_counts = []
+            start = 0
+            for value_code, end in enumerate(np.cumsum(value_class_counts.sum(axis=1))):
+                if end > start:
+                    branches.append(self.feature_values[best_feature][value_code])
+                    branch_rows.append(value_rows[start:end])
+                    children_class_counts.append(value_class_counts[value_code])
+                start = end
+            # ID3 loops on each categorical feature just once
+            remaining_features = [feature for feature in features if feature != best_feature]
+
+        # The class counts of every child are known from the split, the children do not count them again
+        children_sorted_rows = self.split_sorted_rows(sorted_rows, branch_rows)
+        for branch, child_rows, child_sorted_rows, child_class_counts in zip(branches, branch_rows,
+                                                                             children_sorted_rows,
+                                                                             children_class_counts):
+            tree[best_feature_class][branch] = self.build_node(child_rows, remaining_features, child_sorted_rows,
+                                                               depth + 1, child_class_counts)
+
+        return tree
+
+
+def create_tree_encoded(dataset, labels, numeric_features=(), max_thresholds=None, max_depth=None,
+                        min_samples_split=2, min_info_gain=0.0, cache=None):
+    """Creates a decision tree based on ID3, as create_tree does, for big datasets.
+
+    Features and classes are encoded once as integer arrays, and the recursion works on arrays with the indices of
+    the rows of every node, instead of on copies of the dataset. The output is the same nested dictionaries of
+    create_tree, so it can be used with classify, store_tree and the plotter.
+
+    Numeric features, as the ones of the dating dataset of ch2_knn, are split in two branches, with keys
+    NumericBranch('<=', threshold) and NumericBranch('>', threshold), instead of in a branch per value.
+
+        >>> import ch3_trees.trees as trees
+        >>> dataset, features = trees.get_simple_dataset()
+        >>> trees.create_tree_encoded(dataset, features) == trees.create_tree(dataset, features)
+        True
+        >>> import ch2_knn.kNN as knn
+        >>> dating_matrix, dating_labels = knn.file_to_matrix(knn.DATING_DATASET)
+        >>> dating_dataset = [row + [label] for row, label in zip(dating_matrix.tolist(), dating_labels)]
+        >>> dating_features = ['flier miles', 'gaming time', 'ice cream']
+        >>> tree = trees.create_tree_encoded(dating_dataset, dating_features, dating_features, max_thresholds=32)
+
+    :param dataset: list of lists. All the lists are of the same length. The last item in the list is the class
+    of the element.
+    :param labels: a list containing a name for each feature
+    :param numeric_features: labels of the features with numeric values, split by thresholds
+    :param max_thresholds: maximum number of thresholds scored per numeric feature and node, all of them by default
+    :param max_depth: maximum number of decision nodes from the root to a leaf, unlimited by default
+    :param min_samples_split: minimum number of rows of a node to be split
+    :param min_info_gain: minimum information gain of a split
+    :param cache: optional SplitCache, to reuse the statistics of the nodes between trees of the same dataset
+    :return: decision tree in the form of nested dictionaries.
+    """
+    return EncodedTreeBuilder(dataset, labels, numeric_features, max_thresholds, max_depth=max_depth,
+                              min_samples_split=min_samples_split, min_info_gain=min_info_gain,
+                              cache=cache).build()
+
+
 #
 # Using trees for classification
 #
 
 
+@instrumented('trees.classify')
 def classify(input_tree, feature_lab, test_vector):
     """
     Recursive function to use a decision tree as classifier.
     :param input_tree: Previous tree
     :param feature_lab: array with the labels of the features
     :param test_vector:
-    :return: string with the label of the class
+    :return: string with the label of the class, None when the tree has no branch for one of its values
     """
-    first_key = input_tree.keys()[0]
+    label = None
+    first_key = next(iter(input_tree))
     second_level = input_tree[first_key]
     feature_index = feature_lab.index(first_key)
+    value = test_vector[feature_index]
     for key in second_level.keys():
-        if test_vector[feature_index] == key:
+        # Numeric features have a branch for each side of a threshold
+        if isinstance(key, NumericBranch):
+            matches = key.matches(value)
+        else:
+            matches = value == key
+        if matches:
             if isinstance(second_level[key], dict):
                 label = classify(second_level[key], feature_lab, test_vector)
             else:
@@ -227,12 +803,15 @@ def classify(input_tree, feature_lab, test_vector):
 
 def store_tree(tree, filename):
     """ Stores a serialized tree in the given filename.
+    Pickle files must only be grabbed from trusted sources, see trees_compiled.store_tree_binary for a safe and
+    faster format.
 
     :param tree: dict-like object to be stored
     :param filename: output file to write the content of the given tree.
     :return: None
     """
-    with open(filename, 'w') as fo:
+    # Pickle is a binary format, text mode corrupts it in Python 3
+    with open(filename, 'wb') as fo:
         pickle.dump(tree, fo)
 
 
@@ -243,5 +822,5 @@ def grab_tree(filename):
     :return: the deserialized content of the file.
     """
 
-    with open(filename, 'r') as fo:
+    with open(filename, 'rb') as fo:
         return pickle.load(fo)
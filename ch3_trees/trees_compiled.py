@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import numbers
+import struct
+
+import numpy as np
+
+from ch3_trees.trees import NumericBranch
+
+
+# Node and value code meaning "there is no such node/value"
+MISSING = -1
+
+
+class CompiledTree(object):
+    """Decision tree stored as flat parallel arrays, for fast prediction of many samples at once.
+
+    Nodes are numbered in breadth first order, the root is node 0. For every node:
+
+        * feature[node]: index of the feature it splits on, in feature_labels, or MISSING for leaves
+        * child_offset[node]: position in children of the first child of the node. The child for the value with
+         code v of the feature is children[child_offset[node] + v], MISSING when the tree has no branch for it
+        * leaf_class[node]: code of the class of a leaf, in classes, or MISSING for decision nodes
+        * threshold[node]: threshold of the nodes splitting on a numeric feature, NaN for the rest. Their children
+         are children[child_offset[node]] for values <= threshold and children[child_offset[node] + 1] for the
+         values above it
+
+    feature_values[i] holds the values of the feature i, indexed by their code.
+
+        >>> import ch3_trees.trees as trees
+        >>> from ch3_trees.trees_compiled import compile_tree
+        >>> dataset, features = trees.get_simple_dataset()
+        >>> compiled = compile_tree(trees.create_tree(dataset, features), features)
+        >>> compiled.predict([[1, 1], [1, 0], [0, 1]])
+        ['yes', 'no', 'no']
+    """
+
+    def __init__(self, feature, child_offset, children, leaf_class, feature_labels, feature_values, classes,
+                 threshold=None):
+        if threshold is None:
+            threshold = np.full(len(feature), np.nan)
+        self.feature = feature
+        self.child_offset = child_offset
+        self.children = children
+        self.leaf_class = leaf_class
+        self.feature_labels = feature_labels
+        self.feature_values = feature_values
+        self.classes = classes
+        self.threshold = threshold
+        self._is_numeric = ~np.isnan(threshold)
+        self.numeric_features = np.unique(feature[self._is_numeric]).tolist()
+        self._value_codes = [dict((value, code) for code, value in enumerate(values)) for values in feature_values]
+
+    @property
+    def num_nodes(self):
+        return len(self.feature)
+
+    def encode_samples(self, samples):
+        """Encodes the features of the samples with the codes of the tree
+
+        :param samples: list of test vectors, or matrix with a sample per row, with a value per feature label
+        :returns: integer matrix with a row per sample, values unknown to the tree are MISSING
+        """
+        codes = np.empty((len(samples), len(self.feature_labels)), dtype=np.intp)
+        for i, value_codes in enumerate(self._value_codes):
+            codes[:, i] = [value_codes.get(sample[i], MISSING) for sample in samples]
+        return codes
+
+    def encode_numeric_values(self, samples):
+        """Converts the numeric features of the samples, the ones split by thresholds, into floats
+
+        :param samples: list of test vectors, or matrix with a sample per row, with a value per feature label
+        :returns: float matrix with a row per sample, NaN for the features that are not numeric
+        """
+        values = np.full((len(samples), len(self.feature_labels)), np.nan)
+        for i in self.numeric_features:
+            values[:, i] = [sample[i] for sample in samples]
+        return values
+
+    def predict_codes(self, sample_codes, sample_values=None):
+        """Routes all the samples through the tree at once, one level per iteration.
+
+        :param sample_codes: integer matrix with the encoded samples, see encode_samples
+        :param sample_values: float matrix with the numeric features of the samples, see encode_numeric_values.
+         Only needed when the tree has numeric features.
+        :returns: vector with the class code of every sample, MISSING when the tree has no branch for one of its
+         values
+        """
+        num_samples = sample_codes.shape[0]
+        nodes = np.zeros(num_samples, dtype=np.intp)
+        active = np.arange(num_samples)
+
+        while len(active):
+            features = self.feature[nodes[active]]
+            # Samples that reached a leaf stop here
+            deciding = features != MISSING
+            active = active[deciding]
+            features = features[deciding]
+
+            values = sample_codes[active, features]
+            numeric = self._is_numeric[nodes[active]]
+            if numeric.any():
+                # Branch 0 for values <= threshold and 1 above it, NaN is in none of them
+                numeric_values = sample_values[active[numeric], features[numeric]]
+                numeric_thresholds = self.threshold[nodes[active[numeric]]]
+                values[numeric] = np.where(numeric_values <= numeric_thresholds, 0,
+                                           np.where(numeric_values > numeric_thresholds, 1, MISSING))
+            known = values != MISSING
+            next_nodes = np.full(len(active), MISSING, dtype=np.intp)
+            next_nodes[known] = self.children[self.child_offset[nodes[active[known]]] + values[known]]
+            nodes[active] = next_nodes
+            # Samples without branch for their value stop here too
+            active = active[next_nodes != MISSING]
+
+        class_codes = np.full(num_samples, MISSING, dtype=np.intp)
+        reached = nodes != MISSING
+        class_codes[reached] = self.leaf_class[nodes[reached]]
+        return class_codes
+
+    def predict(self, samples, default=None):
+        """Classifies many samples at once, as trees.classify does for a single one
+
+        :param samples: list of test vectors, or matrix with a sample per row, with a value per feature label
+        :param default: class returned for samples with a value the tree has no branch for
+        :returns: list with the class of every sample
+        """
+        sample_values = self.encode_numeric_values(samples) if self.numeric_features else None
+        class_codes = self.predict_codes(self.encode_samples(samples), sample_values)
+        return [self.classes[code] if code != MISSING else default for code in class_codes]
+
+    def to_dict(self, node=0):
+        """Converts the compiled tree back into nested dictionaries. Children are numbered after their parents, so
+        converting the nodes from the last one up finds every child already converted, without a recursive call per
+        node.
+
+        :param node: node to convert, the root by default
+        :returns: decision tree in the form of nested dictionaries
+        """
+        children, child_offset = self.children.tolist(), self.child_offset.tolist()
+        subtrees = [self.classes[code] for code in self.leaf_class.tolist()]
+        decision_nodes = np.flatnonzero(self.feature[node:] != MISSING) + node
+        for current, feature, is_numeric in zip(decision_nodes[::-1].tolist(),
+                                                self.feature[decision_nodes[::-1]].tolist(),
+                                                self._is_numeric[decision_nodes[::-1]].tolist()):
+            offset = child_offset[current]
+            if is_numeric:
+                threshold = float(self.threshold[current])
+                branches = {NumericBranch('<=', threshold): subtrees[children[offset]],
+                            NumericBranch('>', threshold): subtrees[children[offset + 1]]}
+            else:
+                values = self.feature_values[feature]
+                branches = {value: subtrees[child]
+                            for value, child in zip(values, children[offset:offset + len(values)]) if child != MISSING}
+            subtrees[current] = {self.feature_labels[feature]: branches}
+        return subtrees[node]
+
+
+def compile_tree(tree, feature_labels, feature_values=None):
+    """Compiles a decision tree in the form of nested dictionaries into a CompiledTree
+
+    :param tree: decision tree in the form of nested dictionaries, or a single class
+    :param feature_labels: list with the labels of the features, in the order of the test vectors
+    :param feature_values: optional list with the values of every feature, indexed by their code. Trees compiled
+     with the same values encode the samples the same way, so they can share encode_samples. By default only the
+     values used by the tree, in breadth first order.
+    :returns: CompiledTree
+    """
+    feature_labels = list(feature_labels)
+    feature_indices = dict((label, i) for i, label in enumerate(feature_labels))
+    if feature_values is None:
+        value_codes = [{} for _ in feature_labels]
+    else:
+        value_codes = [dict((value, code) for code, value in enumerate(values)) for values in feature_values]
+    class_codes = {}
+
+    # Breadth first traversal, numbering the nodes and every feature value
+    nodes = [tree]
+    for node in nodes:
+        if isinstance(node, dict):
+            feature_label = next(iter(node))
+            codes = value_codes[feature_indices[feature_label]]
+            for value, child in node[feature_label].items():
+                if not isinstance(value, NumericBranch):
+                    codes.setdefault(value, len(codes))
+                nodes.append(child)
+        else:
+            class_codes.setdefault(node, len(class_codes))
+
+    feature = np.full(len(nodes), MISSING, dtype=np.intp)
+    child_offset = np.zeros(len(nodes), dtype=np.intp)
+    leaf_class = np.full(len(nodes), MISSING, dtype=np.intp)
+    threshold = np.full(len(nodes), np.nan)
+    children = []
+
+    # Children are appended in the same order they were numbered
+    next_node = 1
+    for node_id, node in enumerate(nodes):
+        if isinstance(node, dict):
+            feature_label = next(iter(node))
+            feature[node_id] = feature_indices[feature_label]
+            codes = value_codes[feature[node_id]]
+            child_offset[node_id] = len(children)
+            is_numeric = isinstance(next(iter(node[feature_label])), NumericBranch)
+            block = [MISSING] * (2 if is_numeric else len(codes))
+            for value in node[feature_label]:
+                if is_numeric:
+                    threshold[node_id] = value.threshold
+                    slot = 0 if value.operator == '<=' else 1
+                else:
+                    slot = codes[value]
+                block[slot] = next_node
+                next_node += 1
+            children.extend(block)
+        else:
+            leaf_class[node_id] = class_codes[node]
+
+    feature_values = [sorted(codes, key=codes.get) for codes in value_codes]
+    classes = sorted(class_codes, key=class_codes.get)
+    return CompiledTree(feature, child_offset, np.array(children, dtype=np.intp), leaf_class, feature_labels,
+                        feature_values, classes, threshold)
+
+
+#
+# Binary format of compiled trees
+#
+# header: magic, version, flags, the number of items of every section and the item size of every integer section,
+# see HEADER
+# sections, in this order and every one of them padded to 8 bytes:
+#   * value_types: uint8 per interned value, one of the VALUE_TYPE_* tags
+#   * value_offsets: integer per interned value plus one, position of every value in value_data
+#   * value_data: bytes of every interned value
+#   * labels: integer per feature, interned value of its label
+#   * feature_value_offsets: integer per feature plus one, position of the values of every feature in feature_values
+#   * feature_values: integer per value of every feature, interned value
+#   * classes: integer per class, interned value
+#   * feature, leaf_class: integer per node
+#   * children: integer per child slot. The slots of every decision node follow the ones of the previous node, so
+#     child_offset is not stored but computed from the number of slots of every node
+#   * threshold: float64 per node, only when FLAG_THRESHOLD is set, that is when some node splits on a number
+#
+# Integer sections are signed little endian, of the smallest of 1, 2, 4 or 8 bytes that holds all their items
+#
+
+MAGIC = b'ID3T'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('<4sHHqqqqqqq8B')
+FLAG_THRESHOLD = 1
+VALUE_TYPE_INT, VALUE_TYPE_FLOAT, VALUE_TYPE_TEXT, VALUE_TYPE_BYTES, VALUE_TYPE_BOOL = range(5)
+
+
+def encode_value(value):
+    """Binary representation of a feature value, a label or a class
+
+    :param value: int, float, bool, text or bytes
+    :returns: (VALUE_TYPE_* tag, bytes)
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return VALUE_TYPE_BOOL, struct.pack('<?', bool(value))
+    if isinstance(value, numbers.Integral):
+        return VALUE_TYPE_INT, struct.pack('<q', int(value))
+    if isinstance(value, numbers.Real):
+        return VALUE_TYPE_FLOAT, struct.pack('<d', float(value))
+    if isinstance(value, bytes):
+        return VALUE_TYPE_BYTES, value
+    if isinstance(value, type(u'')):
+        return VALUE_TYPE_TEXT, value.encode('utf-8')
+    raise TypeError('Values of type {} cannot be stored in the binary format'.format(type(value).__name__))
+
+
+def decode_value(value_type, data):
+    """Inverse of encode_value
+
+    :param value_type: VALUE_TYPE_* tag
+    :param data: bytes of the value
+    :returns: the value
+    """
+    if value_type == VALUE_TYPE_BOOL:
+        return struct.unpack('<?', data)[0]
+    if value_type == VALUE_TYPE_INT:
+        return struct.unpack('<q', data)[0]
+    if value_type == VALUE_TYPE_FLOAT:
+        return struct.unpack('<d', data)[0]
+    if value_type == VALUE_TYPE_BYTES:
+        return data
+    if value_type == VALUE_TYPE_TEXT:
+        return data.decode('utf-8')
+    raise ValueError('Unknown value type {}'.format(value_type))
+
+
+def padding(size):
+    """Bytes needed to align a section of the given size to 8 bytes"""
+    return b'\0' * (-size % 8)
+
+
+def narrow(array):
+    """Converts an integer array to the smallest signed little endian type that holds all its items
+
+    :param array: array of integers
+    :returns: the converted array
+    """
+    array = np.asarray(array, dtype=np.int64)
+    for item_size in (1, 2, 4):
+        info = np.iinfo('<i{}'.format(item_size))
+        if not len(array) or (info.min <= array.min() and array.max() <= info.max):
+            return array.astype('<i{}'.format(item_size))
+    return array.astype('<i8')
+
+
+def store_compiled_tree(compiled, filename):
+    """Stores a compiled tree in a versioned binary file. Labels, feature values and classes are interned in a
+    single table of values, and nodes are stored as the flat arrays of the compiled tree, with the smallest integer
+    type that holds them. Thresholds are only stored when the tree has numeric splits.
+
+    :param compiled: CompiledTree to be stored
+    :param filename: output file
+    """
+    # Interned values, every one of them is stored once whatever the number of times it is used
+    value_ids = {}
+    encoded_values = []
+
+    def intern(value):
+        encoded = encode_value(value)
+        if encoded not in value_ids:
+            value_ids[encoded] = len(encoded_values)
+            encoded_values.append(encoded)
+        return value_ids[encoded]
+
+    labels = [intern(label) for label in compiled.feature_labels]
+    feature_value_offsets = np.cumsum([0] + [len(values) for values in compiled.feature_values])
+    feature_values = [intern(value) for values in compiled.feature_values for value in values]
+    classes = [intern(clazz) for clazz in compiled.classes]
+    value_types = np.array([value_type for value_type, _ in encoded_values], dtype=np.uint8)
+    value_offsets = np.cumsum([0] + [len(data) for _, data in encoded_values])
+    value_data = b''.join(data for _, data in encoded_values)
+
+    integer_sections = [narrow(array) for array in (value_offsets, labels, feature_value_offsets, feature_values,
+                                                    classes, compiled.feature, compiled.leaf_class,
+                                                    compiled.children)]
+    sections = [value_types.tobytes(), integer_sections[0].tobytes(), value_data]
+    sections.extend(array.tobytes() for array in integer_sections[1:])
+    flags = 0
+    if compiled.numeric_features:
+        flags |= FLAG_THRESHOLD
+        sections.append(np.asarray(compiled.threshold, dtype='<f8').tobytes())
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(encoded_values), len(value_data), len(labels),
+                            len(feature_values), len(classes), compiled.num_nodes, len(compiled.children),
+                            *[array.itemsize for array in integer_sections]))
+        for section in sections:
+            f.write(section)
+            f.write(padding(len(section)))
+
+
+def load_compiled_tree(filename, mmap=True):
+    """Loads a compiled tree stored with store_compiled_tree. The file is read at once, or memory-mapped, and the
+    node arrays are views over it, so no object is built per node. Only child_offset is computed, with a vectorized
+    pass over the nodes.
+
+    :param filename: path to the binary file
+    :param mmap: memory-map the file instead of reading it
+    :returns: CompiledTree
+    """
+    if mmap:
+        buffer = np.memmap(filename, dtype=np.uint8, mode='r')
+    else:
+        with open(filename, 'rb') as f:
+            buffer = np.frombuffer(f.read(), dtype=np.uint8)
+
+    if len(buffer) < HEADER.size:
+        raise ValueError('{} is not a compiled tree file'.format(filename))
+    header = HEADER.unpack(buffer[:HEADER.size].tobytes())
+    (magic, version, flags, num_values, value_data_size, num_features, num_feature_values, num_classes, num_nodes,
+     num_children) = header[:10]
+    if magic != MAGIC:
+        raise ValueError('{} is not a compiled tree file'.format(filename))
+    if version != FORMAT_VERSION:
+        raise ValueError('Unsupported compiled tree format version {}'.format(version))
+
+    counts = [num_values + 1, num_features, num_features + 1, num_feature_values, num_classes, num_nodes, num_nodes,
+              num_children]
+    integer_sections = [('<i{}'.format(item_size), count) for item_size, count in zip(header[10:], counts)]
+    sections = [(np.uint8, num_values)] + integer_sections[:1] + [(np.uint8, value_data_size)] + integer_sections[1:]
+    if flags & FLAG_THRESHOLD:
+        sections.append(('<f8', num_nodes))
+    arrays = []
+    position = HEADER.size
+    for dtype, count in sections:
+        size = np.dtype(dtype).itemsize * count
+        if position + size > len(buffer):
+            raise ValueError('{} is truncated'.format(filename))
+        arrays.append(buffer[position:position + size].view(dtype))
+        position += size + len(padding(size))
+    (value_types, value_offsets, value_data, labels, feature_value_offsets, feature_values, classes, feature,
+     leaf_class, children) = arrays[:10]
+    threshold = arrays[10] if flags & FLAG_THRESHOLD else None
+
+    value_data = value_data.tobytes()
+    values = [decode_value(value_types[i], value_data[value_offsets[i]:value_offsets[i + 1]])
+              for i in range(num_values)]
+    feature_labels = [values[i] for i in labels]
+    compiled_feature_values = [[values[i] for i in feature_values[feature_value_offsets[j]:
+                                                                  feature_value_offsets[j + 1]]]
+                               for j in range(num_features)]
+
+    # Numeric decision nodes have 2 slots, categorical ones a slot per value of their feature and leaves none
+    num_slots = np.zeros(num_nodes, dtype=np.intp)
+    decision = feature != MISSING
+    num_slots[decision] = np.diff(feature_value_offsets)[feature[decision]]
+    if threshold is not None:
+        num_slots[~np.isnan(threshold)] = 2
+    child_offset = np.concatenate(([0], np.cumsum(num_slots)[:-1]))
+    return CompiledTree(feature, child_offset, children, leaf_class, feature_labels, compiled_feature_values,
+                        [values[i] for i in classes], threshold)
+
+
+def get_tree_labels(tree):
+    """Labels of the features used by a decision tree, in breadth first order
+
+    :param tree: decision tree in the form of nested dictionaries
+    :returns: list of labels
+    """
+    labels = []
+    nodes = [tree]
+    for node in nodes:
+        if isinstance(node, dict):
+            label = next(iter(node))
+            if label not in labels:
+                labels.append(label)
+            nodes.extend(node[label].values())
+    return labels
+
+
+def store_tree_binary(tree, filename, feature_labels=None):
+    """Stores a decision tree in the form of nested dictionaries in the binary format of compiled trees.
+    Unlike trees.store_tree, loading the file does not execute any code, so it is safe for untrusted files.
+
+        >>> import ch3_trees.trees as trees
+        >>> import ch3_trees.trees_compiled as trees_compiled
+        >>> dataset, features = trees.get_simple_dataset()
+        >>> tree = trees.create_tree(dataset, features)
+        >>> trees_compiled.store_tree_binary(tree, '/tmp/tree.id3', features)
+        >>> trees_compiled.grab_tree_binary('/tmp/tree.id3') == tree
+        True
+
+    :param tree: decision tree in the form of nested dictionaries
+    :param filename: output file
+    :param feature_labels: list with the labels of the features, in the order of the test vectors. By default the
+     labels used by the tree
+    """
+    if feature_labels is None:
+        feature_labels = get_tree_labels(tree)
+    store_compiled_tree(compile_tree(tree, feature_labels), filename)
+
+
+def grab_tree_binary(filename):
+    """Loads a decision tree stored with store_tree_binary as nested dictionaries.
+    Use load_compiled_tree to predict directly from the file, without building any dictionary.
+
+    :param filename: path to the binary file
+    :returns: decision tree in the form of nested dictionaries
+    """
+    return load_compiled_tree(filename, mmap=False).to_dict()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from math import sqrt
+import multiprocessing
+
+import numpy as np
+
+from ch3_trees import trees
+from ch3_trees.trees_compiled import MISSING, compile_tree
+
+
+NUM_TREES = 50
+
+# State of every worker process, set once by init_worker
+_worker = {}
+
+
+def build_bootstrap_tree(builder, seed):
+    """Builds a tree on a bootstrap sample of the dataset of a builder: as many rows as the dataset, drawn at
+    random with repetition
+
+    :param builder: trees.EncodedTreeBuilder
+    :param seed: seed of the sample and of the random features of every node
+    :returns: decision tree in the form of nested dictionaries
+    """
+    builder.random_state = np.random.RandomState(seed)
+    num_rows = len(builder.class_codes)
+    return builder.build(builder.random_state.randint(0, num_rows, num_rows))
+
+
+def init_worker(dataset, labels, numeric_features, max_thresholds, max_features):
+    """Initializer of the worker processes, the dataset is received and encoded once per worker and not per tree"""
+    _worker['builder'] = trees.EncodedTreeBuilder(dataset, labels, numeric_features, max_thresholds, max_features)
+
+
+def build_tree(seed):
+    """Task of the worker processes: builds a tree of the forest, see build_bootstrap_tree"""
+    return build_bootstrap_tree(_worker['builder'], seed)
+
+
+class RandomForest(object):
+    """Bagged ensemble of ID3 trees. Every tree is built with trees.EncodedTreeBuilder on a bootstrap sample of the
+    dataset, scoring only max_features random features in every node, so the trees are different from each other
+    and their majority vote is more stable than a single tree.
+
+    Trees are built in parallel by a pool of processes, and compiled with a shared encoding of the feature values,
+    so the samples are encoded once and routed through every tree with CompiledTree.predict_codes.
+
+        >>> import ch3_trees.trees as trees
+        >>> from ch3_trees.trees_forest import RandomForest
+        >>> dataset, labels = trees.get_lenses_dataset()
+        >>> forest = RandomForest(num_trees=20, random_state=0).fit(dataset, labels)
+        >>> predictions = forest.predict([item[:-1] for item in dataset])
+    """
+
+    def __init__(self, num_trees=NUM_TREES, max_features=None, numeric_features=(), max_thresholds=None,
+                 random_state=None, processes=None):
+        """
+        :param num_trees: number of trees of the forest
+        :param max_features: number of features, chosen at random, scored in every node. By default the square
+         root of the number of features
+        :param numeric_features: labels of the features with numeric values, split by thresholds
+        :param max_thresholds: maximum number of thresholds scored per numeric feature and node
+        :param random_state: seed of the bootstrap samples and of the random features
+        :param processes: number of worker processes, by default the number of cores. With 1 process the trees are
+         built in the main process.
+        """
+        self.num_trees = num_trees
+        self.max_features = max_features
+        self.numeric_features = list(numeric_features)
+        self.max_thresholds = max_thresholds
+        self.random_state = random_state
+        self.processes = processes
+        self.labels = None
+        self.classes = None
+        self.trees = None
+        self.compiled_trees = None
+        # Code of the classes of every compiled tree in classes
+        self._class_codes = None
+
+    def fit(self, dataset, labels):
+        """Builds the trees of the forest
+
+        :param dataset: list of lists. All the lists are of the same length. The last item in the list is the
+        class of the element.
+        :param labels: a list containing a name for each feature
+        :returns: the forest itself
+        """
+        self.labels = list(labels)
+        max_features = self.max_features
+        if max_features is None:
+            max_features = max(1, int(round(sqrt(len(self.labels)))))
+        seeds = np.random.RandomState(self.random_state).randint(0, 2**31 - 1, self.num_trees).tolist()
+
+        builder_args = (dataset, self.labels, self.numeric_features, self.max_thresholds, max_features)
+        builder = trees.EncodedTreeBuilder(*builder_args)
+        processes = self.processes or multiprocessing.cpu_count()
+        if processes == 1:
+            self.trees = [build_bootstrap_tree(builder, seed) for seed in seeds]
+        else:
+            pool = multiprocessing.Pool(processes, init_worker, builder_args)
+            try:
+                self.trees = pool.map(build_tree, seeds)
+            finally:
+                pool.close()
+                pool.join()
+
+        self.classes = builder.classes
+        class_indices = dict((clazz, code) for code, clazz in enumerate(self.classes))
+        # Numeric features keep an empty list of values, they are not encoded
+        feature_values = [builder.feature_values.get(feature, []) for feature in range(len(self.labels))]
+        self.compiled_trees = [compile_tree(tree, self.labels, feature_values) for tree in self.trees]
+        self._class_codes = [np.array([class_indices[clazz] for clazz in compiled.classes], dtype=np.intp)
+                             for compiled in self.compiled_trees]
+        return self
+
+    def predict_votes(self, samples):
+        """Number of trees voting every class for every sample. Every tree votes for the samples whose values all
+        have a branch in it, numeric values always have one.
+
+            >>> import numpy as np
+            >>> from ch3_trees.trees_forest import RandomForest
+            >>> random_state = np.random.RandomState(0)
+            >>> dataset = [random_state.rand(4).tolist() + [random_state.choice(['a', 'b'])] for _ in range(60)]
+            >>> dataset = [item + ['yes' if item[0] + item[2] > 1 else 'no'] for item in dataset]
+            >>> labels = ['x0', 'x1', 'x2', 'x3', 'c']
+            >>> forest = RandomForest(8, max_features=1, numeric_features=labels[:4], random_state=2, processes=1)
+            >>> votes = forest.fit(dataset, labels).predict_votes([item[:-1] for item in dataset])
+            >>> votes.sum(axis=1).tolist() == [8] * len(dataset)
+            True
+
+        :param samples: list of test vectors, or matrix with a sample per row, with a value per feature label
+        :returns: integer matrix with a row per sample and a column per class, in the order of classes
+        """
+        # Categorical values share the same encoding in every tree, but every tree has its own numeric features
+        sample_codes = self.compiled_trees[0].encode_samples(samples)
+        sample_values = None
+        if self.numeric_features:
+            sample_values = np.full((len(samples), len(self.labels)), np.nan)
+            for feature in self.numeric_features:
+                i = self.labels.index(feature)
+                sample_values[:, i] = [sample[i] for sample in samples]
+
+        num_classes = len(self.classes)
+        votes = np.zeros(len(samples) * num_classes, dtype=np.intp)
+        offsets = np.arange(len(samples)) * num_classes
+        for compiled, class_codes in zip(self.compiled_trees, self._class_codes):
+            tree_codes = compiled.predict_codes(sample_codes, sample_values)
+            # Trees without branch for a value of the sample do not vote
+            voting = tree_codes != MISSING
+            votes += np.bincount(offsets[voting] + class_codes[tree_codes[voting]], minlength=len(votes))
+        return votes.reshape(len(samples), num_classes)
+
+    def predict(self, samples, default=None):
+        """Classifies many samples at once with the majority vote of the trees, ties go to the class seen first in
+        the dataset
+
+        :param samples: list of test vectors, or matrix with a sample per row, with a value per feature label
+        :param default: class returned for samples no tree has a branch for
+        :returns: list with the class of every sample
+        """
+        votes = self.predict_votes(samples)
+        class_codes = np.argmax(votes, axis=1)
+        has_votes = votes.max(axis=1) > 0
+        return [self.classes[code] if voted else default for code, voted in zip(class_codes, has_votes)]
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import multiprocessing
+from multiprocessing.pool import AsyncResult
+
+import numpy as np
+
+from ch3_trees import trees
+
+
+# Nodes with less rows than this are built serially, as a whole subtree, by a single worker
+MIN_PARALLEL_ROWS = 5000
+
+# State of every worker process, set once by init_worker
+_worker = {}
+
+
+def init_worker(dataset, labels):
+    """Initializer of the worker processes, the dataset is received once per worker and not per task"""
+    _worker['dataset'] = dataset
+    _worker['labels'] = labels
+
+
+def get_split_entropies(task):
+    """Task of the worker processes: entropy of the split of a node by some features, as
+    choose_best_splitting_feature calculates it.
+
+    :param task: (array with the rows of the node, list of column indices of the features)
+    :returns: list with the entropy of the split by every feature
+    """
+    rows, features = task
+    dataset = _worker['dataset']
+    value_counts = [{} for _ in features]
+    for row in rows.tolist():
+        item = dataset[row]
+        current_class = item[-1]
+        for i, feature in enumerate(features):
+            counts = value_counts[i].setdefault(item[feature], {})
+            counts[current_class] = counts.get(current_class, 0) + 1
+
+    num_entries = float(len(rows))
+    split_entropies = []
+    for feature_counts in value_counts:
+        split_entropy = 0.0
+        for counts in feature_counts.values():
+            split_entropy += sum(counts.values())/num_entries * trees.get_entropy_from_counts(counts.values())
+        split_entropies.append(split_entropy)
+    return split_entropies
+
+
+def build_subtree(task):
+    """Task of the worker processes: builds serially, with trees.create_tree, the whole subtree of a node
+
+    :param task: (array with the rows of the node, column indices of the features not yet used in the branch)
+    :returns: decision tree of the node in the form of nested dictionaries
+    """
+    rows, features = task
+    dataset = _worker['dataset']
+    node_dataset = [[dataset[row][feature] for feature in features] + [dataset[row][-1]] for row in rows.tolist()]
+    return trees.create_tree(node_dataset, [_worker['labels'][feature] for feature in features])
+
+
+def expand_node(pool, num_processes, dataset, labels, rows, features, min_parallel_rows):
+    """Builds the node with the given rows. Big nodes are split in the main process, scoring their features in
+    parallel, and small ones are sent to the pool as a whole.
+
+    :returns: decision tree of the node, with AsyncResult placeholders for the subtrees being built by the pool
+    """
+    if len(rows) < min_parallel_rows:
+        return pool.apply_async(build_subtree, ((np.array(rows, dtype=np.intp), features),))
+
+    classes_list = [dataset[row][-1] for row in rows]
+    # Check if all element are of the same class, then stop
+    if classes_list.count(classes_list[0]) == len(classes_list):
+        return classes_list[0]
+    # When no more features, return majority
+    if not features:
+        return trees.get_majority_class(classes_list)
+
+    class_counts = {}
+    for clazz in classes_list:
+        class_counts[clazz] = class_counts.get(clazz, 0) + 1
+    base_entropy = trees.get_entropy_from_counts(class_counts.values())
+    # Features are scored in as many tasks as processes, so the rows of the node are sent only once per task
+    rows_array = np.array(rows, dtype=np.intp)
+    features_chunks = [features[i::num_processes] for i in range(min(num_processes, len(features)))]
+    split_entropies = {}
+    for chunk, chunk_entropies in zip(features_chunks, pool.map(get_split_entropies,
+                                                                [(rows_array, chunk) for chunk in features_chunks])):
+        split_entropies.update(zip(chunk, chunk_entropies))
+
+    best_info_gain = 0.0
+    best_feature = None
+    for feature in features:
+        info_gain = base_entropy - split_entropies[feature]
+        if info_gain > best_info_gain + trees.GAIN_TOLERANCE:
+            best_info_gain = info_gain
+            best_feature = feature
+
+    # No feature gives any information, e.g. equal elements of different classes
+    if best_feature is None:
+        return trees.get_majority_class(classes_list)
+
+    value_rows = {}
+    for row in rows:
+        value_rows.setdefault(dataset[row][best_feature], []).append(row)
+
+    # ID3 loops on each feature just once
+    remaining_features = [feature for feature in features if feature != best_feature]
+    branches = {}
+    for value, sub_rows in value_rows.items():
+        branches[value] = expand_node(pool, num_processes, dataset, labels, sub_rows, remaining_features,
+                                      min_parallel_rows)
+    return {labels[best_feature]: branches}
+
+
+def collect_subtrees(tree):
+    """Replaces the AsyncResult placeholders of a tree by the subtrees built by the pool, waiting for them
+
+    :param tree: decision tree returned by expand_node
+    :returns: decision tree in the form of nested dictionaries
+    """
+    if isinstance(tree, AsyncResult):
+        return tree.get()
+    if isinstance(tree, dict):
+        branches = next(iter(tree.values()))
+        for value in branches:
+            branches[value] = collect_subtrees(branches[value])
+    return tree
+
+
+def create_tree_parallel(dataset, labels, processes=None, min_parallel_rows=MIN_PARALLEL_ROWS):
+    """Creates the same decision tree as trees.create_tree, using a pool of processes.
+
+    Nodes with at least min_parallel_rows rows score their features in parallel, one chunk of features per process,
+    and every subtree under them is built at the same time as its siblings. Smaller nodes are built serially by a
+    single worker, where the cost of the tasks would be bigger than the work itself.
+
+        >>> import ch3_trees.trees as trees
+        >>> import ch3_trees.trees_parallel as trees_parallel
+        >>> dataset, features = trees.get_simple_dataset()
+        >>> trees_parallel.create_tree_parallel(dataset, features, 2, 1) == trees.create_tree(dataset, features)
+        True
+
+    :param dataset: list of lists. All the lists are of the same length. The last item in the list is the class
+    of the element.
+    :param labels: a list containing a name for each feature
+    :param processes: number of worker processes, by default the number of cores
+    :param min_parallel_rows: nodes with less rows are built serially
+    :return: decision tree in the form of nested dictionaries.
+    """
+    labels = list(labels)
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes, init_worker, (dataset, labels))
+    try:
+        tree = expand_node(pool, processes, dataset, labels, list(range(len(dataset))), list(range(len(labels))),
+                           min_parallel_rows)
+        return collect_subtrees(tree)
+    finally:
+        pool.close()
+        pool.join()
@@ -15,7 +15,6 @@ u"""Copyright 2015 Mariví Peláez
    limitations under the License.
 """
 from __future__ import division
-import matplotlib.pyplot as plt
 
 
 DECISION_NODE = dict(boxstyle='sawtooth', fc='0.8')
@@ -39,6 +38,8 @@ def plot_basic_node(node_text, center_pt, parent_pt, node_type):
 def create_plot():
     """Basic function to plot a decision tree. It uses a hard coded tree.
     """
+    # matplotlib is only imported when plotting, the tree measures do not need it
+    import matplotlib.pyplot as plt
 
     fig = plt.figure(1, facecolor='white')
     fig.clf()
@@ -60,7 +61,7 @@ def get_number_of_leaves(tree):
     """
 
     num_leafs = 0
-    first_label = tree.keys()[0]
+    first_label = next(iter(tree))
     second_dict = tree[first_label]
     for key in second_dict.keys():
         if isinstance(second_dict[key], dict):
@@ -83,7 +84,7 @@ def get_tree_depth(tree):
     """
 
     max_depth = 0
-    first_label = tree.keys()[0]
+    first_label = next(iter(tree))
     second_dict = tree[first_label]
     for key in second_dict.keys():
         if isinstance(second_dict[key], dict):
@@ -163,7 +164,7 @@ def plot_tree(tree, parent_node, node_text):
     depth = get_tree_depth(tree)
 
     # Get first key in tree
-    key = tree.keys()[0]
+    key = next(iter(tree))
     child_node = (plot_tree.xoff + (1 + num_leaves)/2/plot_tree.total_width, plot_tree.yoff)
 
     plot_mid_text(child_node, parent_node, node_text)
@@ -188,6 +189,7 @@ def create_tree_plot(tree):
     :param tree: nested dictionaries structure containing the decision tree.
     :returns: Plots the tree
     """
+    import matplotlib.pyplot as plt
 
     fig = plt.figure(1, facecolor='white')
     fig.clf()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import functools
+import timeit
+
+from ch3_trees import trees
+from ch3_trees.trees_plotter import get_number_of_leaves, get_tree_depth
+
+
+# Pre-pruning limits compared by pruning_report, the first one grows the whole tree
+PRUNING_LIMITS = [{},
+                  {'max_depth': 2},
+                  {'max_depth': 4},
+                  {'min_samples_split': 10},
+                  {'min_samples_split': 50},
+                  {'min_info_gain': 0.01},
+                  {'min_info_gain': 0.05}]
+
+
+def split_rows(tree, labels, rows):
+    """Sends the rows reaching a decision node down its branches
+
+    :param tree: decision tree in the form of nested dictionaries
+    :param labels: a list containing a name for each feature
+    :param rows: list of lists, the class in the last position
+    :returns: (dict with the rows of every branch, list of rows without branch for their value)
+    """
+    feature_label = next(iter(tree))
+    feature_index = labels.index(feature_label)
+    branches = tree[feature_label]
+    numeric = [key for key in branches if isinstance(key, trees.NumericBranch)]
+
+    branch_rows = dict((key, []) for key in branches)
+    lost_rows = []
+    for item in rows:
+        value = item[feature_index]
+        if numeric:
+            key = next((key for key in numeric if key.matches(value)), None)
+        else:
+            key = value if value in branches else None
+        if key is None:
+            lost_rows.append(item)
+        else:
+            branch_rows[key].append(item)
+    return branch_rows, lost_rows
+
+
+def prune_node(tree, labels, training_rows, validation_rows):
+    """Recursive step of prune_tree
+
+    :returns: (pruned tree, number of validation rows it misclassifies)
+    """
+    if not isinstance(tree, dict):
+        return tree, sum(1 for item in validation_rows if item[-1] != tree)
+
+    training_branches, _ = split_rows(tree, labels, training_rows)
+    validation_branches, lost_rows = split_rows(tree, labels, validation_rows)
+
+    # Children are pruned first, so the node is compared with its already pruned subtree
+    feature_label = next(iter(tree))
+    branches = {}
+    # Rows without branch cannot be classified
+    subtree_errors = len(lost_rows)
+    for key, subtree in tree[feature_label].items():
+        branches[key], errors = prune_node(subtree, labels, training_branches[key], validation_branches[key])
+        subtree_errors += errors
+    pruned = {feature_label: branches}
+
+    if not training_rows:
+        return pruned, subtree_errors
+    majority_class = trees.get_majority_class([item[-1] for item in training_rows])
+    leaf_errors = sum(1 for item in validation_rows if item[-1] != majority_class)
+    if leaf_errors <= subtree_errors:
+        return majority_class, leaf_errors
+    return pruned, subtree_errors
+
+
+def prune_tree(tree, labels, training_dataset, validation_dataset):
+    """Reduced error pruning: from the bottom up, every decision node is replaced by a leaf with the majority class
+    of its training rows when that leaf does not misclassify more validation rows than the node.
+
+        >>> import ch3_trees.trees as trees
+        >>> from ch3_trees.trees_pruning import prune_tree
+        >>> dataset, labels = trees.get_lenses_dataset()
+        >>> tree = trees.create_tree_encoded(dataset[::2], labels)
+        >>> pruned_tree = prune_tree(tree, labels, dataset[::2], dataset[1::2])
+
+    :param tree: decision tree in the form of nested dictionaries
+    :param labels: a list containing a name for each feature
+    :param training_dataset: list of lists the tree was built from, the class in the last position
+    :param validation_dataset: list of lists not used to build the tree, the class in the last position
+    :returns: pruned decision tree, a new one that does not share any node with tree
+    """
+    return prune_node(tree, list(labels), training_dataset, validation_dataset)[0]
+
+
+def get_tree_size(tree):
+    """Number of nodes, number of leaves and depth of a tree, the last two as the plotter measures them
+
+    :param tree: decision tree in the form of nested dictionaries, or a single class
+    :returns: (number of nodes, number of leaves, depth)
+    """
+    if not isinstance(tree, dict):
+        return 1, 1, 0
+    num_nodes = 0
+    nodes = [tree]
+    for node in nodes:
+        num_nodes += 1
+        if isinstance(node, dict):
+            nodes.extend(next(iter(node.values())).values())
+    return num_nodes, get_number_of_leaves(tree), get_tree_depth(tree)
+
+
+def classify_samples(tree, labels, samples):
+    """Classifies every sample with trees.classify, a tree that is a single class predicts it for all of them
+
+    :param tree: decision tree in the form of nested dictionaries, or a single class
+    :param labels: a list containing a name for each feature
+    :param samples: list of test vectors
+    :returns: list with the class of every sample
+    """
+    if not isinstance(tree, dict):
+        return [tree] * len(samples)
+    return [trees.classify(tree, labels, sample) for sample in samples]
+
+
+def pruning_report(training_dataset, validation_dataset, labels, limits=PRUNING_LIMITS, numeric_features=(),
+                   repeat=3):
+    """Builds a tree with every pre-pruning limit, and with reduced error pruning of the whole tree, and reports
+    their size, their error on the validation set and the time to classify a sample with trees.classify.
+
+        >>> import benchmarks.trees_predict as bench
+        >>> from ch3_trees.trees_pruning import pruning_report
+        >>> dataset, labels = bench.make_categorical_dataset(4000, 8, 3, 3, noise=0.3)
+        >>> report = pruning_report(dataset[:3000], dataset[3000:], labels)  # doctest: +ELLIPSIS
+        split cache: ... hits, ... misses, ... evictions
+        limits                          nodes   leaves  depth    error    us/sample
+        no limits ...
+        reduced error pruning ...
+
+    :param training_dataset: list of lists to build the trees from, the class in the last position
+    :param validation_dataset: list of lists to measure the error and to prune the tree, the class in the last
+     position
+    :param labels: a list containing a name for each feature
+    :param limits: list of dicts with the keyword arguments of trees.create_tree_encoded for every tree
+    :param numeric_features: labels of the features with numeric values, split by thresholds
+    :param repeat: number of classifications of the validation set, the best one is reported
+    :returns: list with a dict per tree with its name, number of nodes and leaves, depth, validation error rate
+     and seconds per classified sample
+    """
+    labels = list(labels)
+    samples = [item[:-1] for item in validation_dataset]
+
+    # Every tree grows from the same nodes as the previous ones, until its limits stop it
+    cache = trees.SplitCache()
+    models = []
+    for tree_limits in limits:
+        name = ', '.join('{}={}'.format(key, tree_limits[key]) for key in sorted(tree_limits)) or 'no limits'
+        models.append((name, trees.create_tree_encoded(training_dataset, labels, numeric_features, cache=cache,
+                                                       **tree_limits)))
+    full_tree = trees.create_tree_encoded(training_dataset, labels, numeric_features, cache=cache)
+    print('split cache: {} hits, {} misses, {} evictions'.format(cache.hits, cache.misses, cache.evictions))
+    models.append(('reduced error pruning', prune_tree(full_tree, labels, training_dataset, validation_dataset)))
+
+    report = []
+    print('{:<28} {:>8} {:>8} {:>6} {:>8} {:>12}'.format('limits', 'nodes', 'leaves', 'depth', 'error',
+                                                         'us/sample'))
+    for name, tree in models:
+        num_nodes, num_leaves, depth = get_tree_size(tree)
+        classify = functools.partial(classify_samples, tree, labels, samples)
+        predictions = classify()
+        latency = min(timeit.repeat(classify, number=1, repeat=repeat))/len(samples)
+        error_rate = sum(1 for item, prediction in zip(validation_dataset, predictions)
+                         if item[-1] != prediction)/float(len(samples))
+
+        report.append({'name': name, 'nodes': num_nodes, 'leaves': num_leaves, 'depth': depth, 'error_rate': error_rate,
+                       'latency': latency})
+        print('{:<28} {:>8} {:>8} {:>6} {:>8.4f} {:>12.2f}'.format(name, num_nodes, num_leaves, depth, error_rate,
+                                                                   latency * 1e6))
+    return report
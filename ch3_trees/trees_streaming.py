@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from math import log, sqrt
+
+from ch3_trees import trees
+
+
+# Number of elements a leaf sees between two evaluations of its splits
+GRACE_PERIOD = 200
+# Probability of choosing a wrong feature to split a leaf
+SPLIT_CONFIDENCE = 1e-7
+# Gain difference below which two features are considered tied, and the best one is chosen anyway
+TIE_THRESHOLD = 0.05
+
+
+def iter_file_rows(filename, separator=None):
+    """Reads the rows of a data file one at a time, without loading the whole file
+        filename format: field1, field2, ..., fieldN, class
+
+    :param filename: path to the data file
+    :param separator: fields separator, any whitespace by default
+    :returns: generator of lists of fields, the class in the last position
+    """
+    with open(filename) as f:
+        for line in f:
+            fields = line.split(separator)
+            if fields:
+                yield [field.strip() for field in fields]
+
+
+class HoeffdingNode(object):
+    """Node of a HoeffdingTree. Leaves keep the sufficient statistics of the elements they have seen, decision
+    nodes only their feature and children.
+    """
+
+    def __init__(self, features, class_counts=None):
+        """
+        :param features: list with the column index of the features not yet used in the branch
+        :param class_counts: initial number of elements per class
+        """
+        self.features = features
+        self.class_counts = dict(class_counts or {})
+        # {feature: {value: {class: number of elements}}}, only for leaves
+        self.split_counts = dict((feature, {}) for feature in features)
+        self.seen_since_evaluation = 0
+        self.feature = None
+        self.children = None
+
+    def is_leaf(self):
+        return self.feature is None
+
+    def num_elements(self):
+        return sum(self.class_counts.values())
+
+    def majority_class(self):
+        """Class with more elements in the node, ties go to the class seen first"""
+        return max(self.class_counts, key=self.class_counts.get)
+
+    def learn(self, row):
+        """Updates the statistics of the leaf with a new element
+
+        :param row: list of features, the class in the last position
+        """
+        current_class = row[-1]
+        self.class_counts[current_class] = self.class_counts.get(current_class, 0) + 1
+        for feature in self.features:
+            value_counts = self.split_counts[feature].setdefault(row[feature], {})
+            value_counts[current_class] = value_counts.get(current_class, 0) + 1
+        self.seen_since_evaluation += 1
+
+    def info_gains(self):
+        """Information gain of splitting the leaf by every one of its features, from its statistics
+
+        :returns: list of (information gain, feature), from the best one to the worst one
+        """
+        num_entries = float(self.num_elements())
+        base_entropy = trees.get_entropy_from_counts(self.class_counts.values())
+        gains = []
+        for feature in self.features:
+            split_entropy = 0.0
+            for value_counts in self.split_counts[feature].values():
+                split_entropy += sum(value_counts.values())/num_entries * \
+                    trees.get_entropy_from_counts(value_counts.values())
+            gains.append((base_entropy - split_entropy, feature))
+        # Stable sort, tied features keep their order
+        return sorted(gains, key=lambda gain: -gain[0])
+
+    def split(self, feature):
+        """Turns the leaf into a decision node. Its statistics are dropped, every new leaf starts with the class
+        counts of its value.
+
+        :param feature: column index of the feature to split the leaf by
+        """
+        remaining_features = [item for item in self.features if item != feature]
+        self.children = dict((value, HoeffdingNode(remaining_features, value_counts))
+                             for value, value_counts in self.split_counts[feature].items())
+        self.feature = feature
+        self.split_counts = None
+
+
+class HoeffdingTree(object):
+    """Incremental ID3 decision tree (Hoeffding tree), that learns from a stream of rows instead of from a list of
+    lists, as trees.create_tree does.
+
+    Every leaf keeps the number of elements per class for every value of every feature. Every grace_period
+    elements, the leaf checks whether the best feature is better than the second one with confidence
+    1 - split_confidence, using the Hoeffding bound, and then it is split. Memory is bounded by the number of
+    different (feature, value, class) combinations in the leaves, and not by the number of rows.
+
+        >>> import ch3_trees.trees as trees
+        >>> from ch3_trees.trees_streaming import HoeffdingTree, iter_file_rows
+        >>> tree = HoeffdingTree(trees.LENSES_LABELS, grace_period=5)
+        >>> tree.learn(row[1:] for row in iter_file_rows(trees.LENSES_DATASET))
+        >>> nested_tree = tree.to_dict()
+    """
+
+    def __init__(self, labels, grace_period=GRACE_PERIOD, split_confidence=SPLIT_CONFIDENCE,
+                 tie_threshold=TIE_THRESHOLD):
+        """
+        :param labels: a list containing a name for each feature
+        :param grace_period: number of elements a leaf sees between two evaluations of its splits
+        :param split_confidence: probability of choosing a wrong feature to split a leaf
+        :param tie_threshold: gain difference below which the best feature is chosen even if it is not proven
+         better than the second one
+        """
+        self.labels = list(labels)
+        self.grace_period = grace_period
+        self.split_confidence = split_confidence
+        self.tie_threshold = tie_threshold
+        self.root = HoeffdingNode(list(range(len(self.labels))))
+        self.classes = set()
+
+    def find_leaf(self, row):
+        """Leaf a row falls into. Values never seen by a decision node get a new empty leaf.
+
+        :param row: list of features
+        :returns: HoeffdingNode
+        """
+        node = self.root
+        while not node.is_leaf():
+            value = row[node.feature]
+            if value not in node.children:
+                node.children[value] = HoeffdingNode([item for item in node.features if item != node.feature])
+            node = node.children[value]
+        return node
+
+    def hoeffding_bound(self, num_elements):
+        """Maximum difference, with confidence 1 - split_confidence, between the observed mean of the information
+        gain and its real value after num_elements elements
+
+        :param num_elements: number of elements seen by a leaf
+        :returns: float
+        """
+        # Range of the information gain, log2 of the number of classes
+        gain_range = log(max(len(self.classes), 2), 2)
+        return sqrt(gain_range**2 * log(1.0/self.split_confidence) / (2.0 * num_elements))
+
+    def learn_one(self, row):
+        """Learns a single element, splitting its leaf if there is enough evidence
+
+        :param row: list of features, the class in the last position
+        """
+        self.classes.add(row[-1])
+        leaf = self.find_leaf(row)
+        leaf.learn(row)
+
+        if leaf.seen_since_evaluation < self.grace_period or not leaf.features or len(leaf.class_counts) < 2:
+            return
+        leaf.seen_since_evaluation = 0
+
+        gains = leaf.info_gains()
+        best_gain, best_feature = gains[0]
+        second_gain = gains[1][0] if len(gains) > 1 else 0.0
+        bound = self.hoeffding_bound(leaf.num_elements())
+        if best_gain > trees.GAIN_TOLERANCE and (best_gain - second_gain > bound or bound < self.tie_threshold):
+            leaf.split(best_feature)
+
+    def learn(self, rows):
+        """Learns every element of an iterable, e.g. iter_file_rows, or a list of lists
+
+        :param rows: iterable of lists of features, the class in the last position
+        """
+        for row in rows:
+            self.learn_one(row)
+
+    def classify(self, test_vector):
+        """Classifies a test vector with the majority class of its leaf
+
+        :param test_vector: list of features
+        :returns: class of the test vector, None if the leaf has not seen any element
+        """
+        node = self.root
+        while not node.is_leaf() and test_vector[node.feature] in node.children:
+            node = node.children[test_vector[node.feature]]
+        if not node.class_counts:
+            return None
+        return node.majority_class()
+
+    def num_statistics(self):
+        """Number of (feature, value, class) counters kept in the leaves, the memory used by the tree
+
+        :returns: integer
+        """
+        total = 0
+        nodes = [self.root]
+        for node in nodes:
+            if node.is_leaf():
+                total += sum(len(value_counts) for feature_counts in node.split_counts.values()
+                             for value_counts in feature_counts.values())
+            else:
+                nodes.extend(node.children.values())
+        return total
+
+    def to_dict(self, node=None):
+        """Converts the tree into the nested dictionaries of trees.create_tree, so it can be used with
+        trees.classify, trees.store_tree and the plotter. Leaves without elements are left out.
+
+        :param node: node to convert, the root by default
+        :returns: decision tree in the form of nested dictionaries, or a class when the tree is a single leaf
+        """
+        if node is None:
+            node = self.root
+        if node.is_leaf():
+            return node.majority_class() if node.class_counts else None
+
+        branches = {}
+        for value, child in node.children.items():
+            subtree = self.to_dict(child)
+            if subtree is not None:
+                branches[value] = subtree
+        return {self.labels[node.feature]: branches}
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+u"""Copyright 2015 Mariví Peláez
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import functools
+import inspect
+import sys
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no tracemalloc, memory cannot be tracked
+    tracemalloc = None
+
+
+# (function, phase, count_rows) of every instrumented function
+_registry = []
+# (owner, attribute name, original function) of every function replaced while collecting
+_patched = []
+# PhaseStats collecting, instrumentation is disabled while it is empty
+_collectors = []
+# Number of calls of every phase in progress, only the outermost one is timed
+_open_phases = {}
+# Memory frame of every phase in progress: [traced memory when it started, highest peak seen while it runs]
+_memory_frames = []
+
+
+def argument_rows(position=0):
+    """Rows processed by a call: the length of one of its positional arguments"""
+    return lambda args, result: len(args[position])
+
+
+def result_rows(position=None):
+    """Rows processed by a call: the length of its result, or of an item of its result when it is a tuple"""
+    return lambda args, result: len(result if position is None else result[position])
+
+
+def instrumented(phase, count_rows=None):
+    """Decorator registering the functions of a phase, e.g. 'knn.distances'. The function itself is not changed,
+    so there is no overhead at all while no PhaseStats is collecting. While collecting, the module function or
+    class method is replaced by a timed version, see enable.
+
+    :param phase: name of the phase
+    :param count_rows: function of (positional arguments, result) returning the rows processed by a call, see
+     argument_rows and result_rows. One row per call by default.
+    """
+    def decorator(function):
+        _registry.append((function, phase, count_rows))
+        return function
+    return decorator
+
+
+def get_owners(function):
+    """Module and classes holding a function, as a module function or as a method
+
+    :returns: list of modules and classes
+    """
+    module = sys.modules.get(function.__module__)
+    if module is None:
+        return []
+    owners = [module] if getattr(module, function.__name__, None) is function else []
+    owners.extend(value for value in vars(module).values()
+                  if inspect.isclass(value) and vars(value).get(function.__name__) is function)
+    return owners
+
+
+def timed(function, phase, count_rows):
+    """Version of an instrumented function recording its calls, see run_phase"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return run_phase(phase, count_rows, function, args, kwargs)
+    return wrapper
+
+
+def enable():
+    """Replaces every instrumented function by a version recording its calls. Only the calls through the module or
+    class attribute are recorded, not references taken before, e.g. with from ... import
+    """
+    for function, phase, count_rows in _registry:
+        wrapper = timed(function, phase, count_rows)
+        for owner in get_owners(function):
+            setattr(owner, function.__name__, wrapper)
+            _patched.append((owner, function.__name__, function))
+
+
+def disable():
+    """Restores the original instrumented functions"""
+    while _patched:
+        owner, name, function = _patched.pop()
+        setattr(owner, name, function)
+
+
+def traced_peak():
+    """Updates the peak of every phase in progress with the traced peak, and resets it
+
+    :returns: currently traced memory in bytes
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    for frame in _memory_frames:
+        frame[1] = max(frame[1], peak)
+    # Python < 3.9 cannot reset the peak, phases then report the peak since the tracing started
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    return current
+
+
+def run_phase(phase, count_rows, function, args, kwargs):
+    """Calls a function of a phase and records it in every collecting PhaseStats"""
+    outermost = not _open_phases.get(phase)
+    track_memory = outermost and tracemalloc is not None and tracemalloc.is_tracing()
+    if track_memory:
+        current = traced_peak()
+        _memory_frames.append([current, current])
+
+    _open_phases[phase] = _open_phases.get(phase, 0) + 1
+    start_time = default_timer()
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        seconds = default_timer() - start_time
+        _open_phases[phase] -= 1
+        peak_bytes = 0
+        if track_memory:
+            traced_peak()
+            start_memory, peak = _memory_frames.pop()
+            peak_bytes = peak - start_memory
+
+    rows = count_rows(args, result) if count_rows is not None else 1
+    for collector in _collectors:
+        collector.record(phase, seconds if outermost else 0.0, rows, peak_bytes)
+    return result
+
+
+class PhaseStats(object):
+    """Statistics of the instrumented phases of kNN and trees, collected while used as a context manager.
+
+    For every phase it keeps the number of calls, the wall time of the outermost calls, so recursive functions are
+    not counted twice, the rows processed by all of them and, with track_memory, the peak of memory allocated by a
+    single outermost call, numpy arrays included.
+
+        >>> import ch3_trees.trees as trees
+        >>> from instrumentation.phases import PhaseStats
+        >>> dataset, features = trees.get_simple_dataset()
+        >>> with PhaseStats() as stats:
+        ...     tree = trees.create_tree(dataset, features)
+        >>> stats.phases['trees.build']['calls'], stats.phases['trees.build']['rows']
+        (5, 13)
+    """
+
+    def __init__(self, track_memory=False):
+        """
+        :param track_memory: trace memory allocations with tracemalloc, which makes the phases slower
+        """
+        if track_memory and tracemalloc is None:
+            raise ValueError('Memory tracking needs tracemalloc, available since Python 3.4')
+        self.track_memory = track_memory
+        self.phases = {}
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if not _collectors:
+            enable()
+        _collectors.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _collectors.remove(self)
+        if not _collectors:
+            disable()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def record(self, phase, seconds, rows, peak_bytes):
+        """Adds a call to the statistics of a phase
+
+        :param phase: name of the phase
+        :param seconds: wall time of the call, 0 for calls inside another call of the same phase
+        :param rows: rows processed by the call
+        :param peak_bytes: peak of memory allocated during the call
+        """
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = {'calls': 0, 'seconds': 0.0, 'rows': 0, 'peak_bytes': 0}
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+        stats['rows'] += rows
+        stats['peak_bytes'] = max(stats['peak_bytes'], peak_bytes)
+
+    def report(self):
+        """Prints the statistics of every phase, from the slowest one
+
+        :returns: dict with the statistics of every phase
+        """
+        print('{:<24} {:>10} {:>12} {:>12} {:>14}'.format('phase', 'calls', 'seconds', 'rows', 'peak MB'))
+        for phase in sorted(self.phases, key=lambda name: -self.phases[name]['seconds']):
+            stats = self.phases[phase]
+            print('{:<24} {:>10} {:>12.4f} {:>12} {:>14.2f}'.format(phase, stats['calls'], stats['seconds'],
+                                                                    stats['rows'],
+                                                                    stats['peak_bytes'] / (1024.0 * 1024.0)))
+        return self.phases